@@ -0,0 +1,43 @@
+import threading
+import queue
+from collections import deque
+
+
+class DropOldestQueue:
+    """Bounded queue that discards the oldest item instead of blocking the producer."""
+
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                raise queue.Empty
+            if not self.items:
+                raise queue.Empty
+            return self.items.popleft()
+
+    def drain(self, max_items=None, timeout=None):
+        # Blocks like get(), then returns every queued item (up to max_items) at once
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                raise queue.Empty
+            if not self.items:
+                raise queue.Empty
+            count = len(self.items) if max_items is None else min(max_items, len(self.items))
+            return [self.items.popleft() for _ in range(count)]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
@@ -1,28 +1,45 @@
 from time import time
 
-last_alert_time = {}
 ALERT_COOLDOWN = 3  # Seconds between alerts
 
+# Joint angles this analyzer reads, as (p1, p2, p3) landmark triples
+JOINT_ANGLES = {
+    'hip_angle': (11, 23, 27),  # Shoulder-hip-ankle line
+    'shoulder_angle': (13, 11, 23)  # Elbow-shoulder-hip
+}
+
+class PlankAnalyzer:
+    """Form checker for one trainee; the alert cooldown lives on the instance."""
+
+    def __init__(self):
+        self.last_alert_time = 0
+
+    def analyze(self, joint_angles):
+        hip_angle = joint_angles.get('hip_angle', 0)
+        shoulder_angle = joint_angles.get('shoulder_angle', 0)
+
+        feedback = []
+        if hip_angle < 160:
+            feedback.append("Raise hips slightly.")
+        elif hip_angle > 170:
+            feedback.append("Lower hips slightly.")
+
+        if shoulder_angle < 70:
+            feedback.append("Move shoulders forward.")
+        elif shoulder_angle > 110:
+            feedback.append("Move shoulders back.")
+
+        if not feedback:
+            feedback.append("Maintain current form.")
+
+        current_time = time()
+        if current_time - self.last_alert_time > ALERT_COOLDOWN:
+            self.last_alert_time = current_time
+            return ". ".join(feedback)
+        return ""
+
+# Shared analyzer for single-trainee callers of analyze_plank
+default_analyzer = PlankAnalyzer()
+
 def analyze_plank(joint_angles):
-    hip_angle = joint_angles.get('hip_angle', 0)
-    shoulder_angle = joint_angles.get('shoulder_angle', 0)
-
-    feedback = []
-    if hip_angle < 160:
-        feedback.append("Raise hips slightly.")
-    elif hip_angle > 170:
-        feedback.append("Lower hips slightly.")
-
-    if shoulder_angle < 70:
-        feedback.append("Move shoulders forward.")
-    elif shoulder_angle > 110:
-        feedback.append("Move shoulders back.")
-
-    if not feedback:
-        feedback.append("Maintain current form.")
-
-    current_time = time()
-    if current_time - last_alert_time.get('plank', 0) > ALERT_COOLDOWN:
-        last_alert_time['plank'] = current_time
-        return ". ".join(feedback)
-    return ""
\ No newline at end of file
+    return default_analyzer.analyze(joint_angles)
\ No newline at end of file
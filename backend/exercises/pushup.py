@@ -1,17 +1,16 @@
 from time import time
 import numpy as np
+from exercises.reps import RepEngine
 
-# Global variables
-pushup_correct_count = 0
-pushup_incorrect_count = 0
-pushup_state = None
-pushup_prev_state = None
-pushup_last_active_time = time()
-pushup_state_sequence = []
-
-last_feedback_time = 0
 FEEDBACK_COOLDOWN = 2  # seconds
 
+# Joint angles this analyzer reads (see joint_angles.JOINT_TRIPLES)
+JOINT_ANGLES = (
+    'left_elbow_angle', 'right_elbow_angle',
+    'left_hip_angle_pushup', 'right_hip_angle_pushup',
+    'left_hand_to_shoulder_angle', 'right_hand_to_shoulder_angle'
+)
+
 def get_pushup_state(elbow_angle):
     if elbow_angle > 160:
         return 'up'
@@ -20,84 +19,119 @@ def get_pushup_state(elbow_angle):
     else:
         return 'middle'
 
-def analyze_pushup(joint_angles):
-    global pushup_correct_count, pushup_incorrect_count, pushup_state, pushup_prev_state, pushup_last_active_time, pushup_state_sequence, last_feedback_time
-
-    # Extract angles
-    left_elbow_angle = joint_angles.get('left_elbow_angle', 0)
-    right_elbow_angle = joint_angles.get('right_elbow_angle', 0)
-    elbow_angle = (left_elbow_angle + right_elbow_angle) / 2
-
-    left_hip_angle_pushup = joint_angles.get('left_hip_angle_pushup', 0)
-    right_hip_angle_pushup = joint_angles.get('right_hip_angle_pushup', 0)
-    hip_angle = (left_hip_angle_pushup + right_hip_angle_pushup) / 2
-
-    left_hand_to_shoulder_angle = joint_angles.get('left_hand_to_shoulder_angle', 0)
-    right_hand_to_shoulder_angle = joint_angles.get('right_hand_to_shoulder_angle', 0)
-    hand_to_shoulder_angle = (left_hand_to_shoulder_angle + right_hand_to_shoulder_angle) / 2
-
-    # Determine current state
-    current_state = get_pushup_state(elbow_angle)
-
-    # Update state sequence
-    if pushup_state != current_state:
-        pushup_prev_state = pushup_state
-        pushup_state = current_state
-        pushup_state_sequence.append(current_state)
-        if len(pushup_state_sequence) > 3:
-            pushup_state_sequence.pop(0)
-
-    # Count reps
-    feedback = []
-    if pushup_prev_state == 'down' and pushup_state == 'up':
-        # Completed a pushup
-        if 165 <= hip_angle <= 195:
-            pushup_correct_count += 1
-            feedback.append("Good pushup!")
+PUSHUP_STATES = ('up', 'middle', 'down')
+
+def classify_states(elbow_angle):
+    # Vectorized get_pushup_state: indices into PUSHUP_STATES
+    return np.where(elbow_angle > 160, 0, np.where(elbow_angle < 90, 2, 1))
+
+def create_rep_engine():
+    # A rep ends on returning to 'up' and only counts if 'down' was reached on the way
+    return RepEngine(PUSHUP_STATES, classify_states, top='up', bottom='down', window=3)
+
+def is_straight(hip_angle):
+    return (165 <= hip_angle) & (hip_angle <= 195)
+
+class PushupAnalyzer:
+    """Rep counter and form checker for one trainee; all state lives on the instance."""
+
+    def __init__(self):
+        self.correct_count = 0
+        self.incorrect_count = 0
+        self.reps = create_rep_engine()
+        self.last_active_time = time()
+        self.last_feedback_time = 0
+
+    def analyze(self, joint_angles):
+        # Extract angles
+        left_elbow_angle = joint_angles.get('left_elbow_angle', 0)
+        right_elbow_angle = joint_angles.get('right_elbow_angle', 0)
+        elbow_angle = (left_elbow_angle + right_elbow_angle) / 2
+
+        left_hip_angle_pushup = joint_angles.get('left_hip_angle_pushup', 0)
+        right_hip_angle_pushup = joint_angles.get('right_hip_angle_pushup', 0)
+        hip_angle = (left_hip_angle_pushup + right_hip_angle_pushup) / 2
+
+        left_hand_to_shoulder_angle = joint_angles.get('left_hand_to_shoulder_angle', 0)
+        right_hand_to_shoulder_angle = joint_angles.get('right_hand_to_shoulder_angle', 0)
+        hand_to_shoulder_angle = (left_hand_to_shoulder_angle + right_hand_to_shoulder_angle) / 2
+
+        # Determine current state and whether a rep just finished
+        current_state, rep = self.reps.update(elbow_angle)
+
+        # Count reps
+        feedback = []
+        if rep:
+            # Completed a pushup
+            if is_straight(hip_angle):
+                self.correct_count += 1
+                feedback.append("Good pushup!")
+            else:
+                self.incorrect_count += 1
+                feedback.append("Keep body straight during pushup.")
+
+        # Provide feedback based on current state
+        if current_state == 'down':
+            if elbow_angle > 140:
+                feedback.append("Lower chest more")
+        elif current_state == 'up':
+            if elbow_angle < 160:
+                feedback.append("Extend arms fully")
+
+        # Form feedback (applicable in any state)
+        if hip_angle < 165:
+            feedback.append("Raise hips")
+        elif hip_angle > 195:
+            feedback.append("Lower hips slightly")
+
+        if hand_to_shoulder_angle < 50:
+            feedback.append("Widen hand placement")
+        elif hand_to_shoulder_angle > 130:
+            feedback.append("Narrow hand placement")
+
+        # Progress calculation based on elbow angle
+        per = np.interp(elbow_angle, (90, 160), (100, 0))
+        bar = np.interp(elbow_angle, (90, 160), (50, 380))
+
+        # Debug information
+        debug_info = f"Reps: {self.correct_count}, State: {current_state}, Elbow: {elbow_angle:.1f}°, Hip: {hip_angle:.1f}°, Hand-Shoulder: {hand_to_shoulder_angle:.1f}°"
+
+        # Update last active time
+        self.last_active_time = time()
+        print(f"Hip Angle: {hip_angle}")
+
+        # Feedback cooldown
+        current_time = time()
+        if current_time - self.last_feedback_time >= FEEDBACK_COOLDOWN:
+            self.last_feedback_time = current_time
+            if feedback:
+                feedback_message = ". ".join(feedback)
+                print(f"Exercise Feedback: {feedback_message}")
+            else:
+                feedback_message = "Maintain current form"
         else:
-            pushup_incorrect_count += 1
-            feedback.append("Keep body straight during pushup.")
-
-    # Provide feedback based on current state
-    if current_state == 'down':
-        if elbow_angle > 140:
-            feedback.append("Lower chest more")
-    elif current_state == 'up':
-        if elbow_angle < 160:
-            feedback.append("Extend arms fully")
-
-    # Form feedback (applicable in any state)
-    if hip_angle < 165:
-        feedback.append("Raise hips")
-    elif hip_angle > 195:
-        feedback.append("Lower hips slightly")
-
-    if hand_to_shoulder_angle < 50:
-        feedback.append("Widen hand placement")
-    elif hand_to_shoulder_angle > 130:
-        feedback.append("Narrow hand placement")
-
-    # Progress calculation based on elbow angle
-    per = np.interp(elbow_angle, (90, 160), (100, 0))
-    bar = np.interp(elbow_angle, (90, 160), (50, 380))
-
-    # Debug information
-    debug_info = f"Reps: {pushup_correct_count}, State: {current_state}, Elbow: {elbow_angle:.1f}°, Hip: {hip_angle:.1f}°, Hand-Shoulder: {hand_to_shoulder_angle:.1f}°"
-
-    # Update last active time
-    pushup_last_active_time = time()
-    print(f"Hip Angle: {hip_angle}")
-
-    # Feedback cooldown
-    current_time = time()
-    if current_time - last_feedback_time >= FEEDBACK_COOLDOWN:
-        last_feedback_time = current_time
-        if feedback:
-            feedback_message = ". ".join(feedback)
-            print(f"Exercise Feedback: {feedback_message}")
-        else:
-            feedback_message = "Maintain current form"
-    else:
-        feedback_message = ""  # No feedback during cooldown
+            feedback_message = ""  # No feedback during cooldown
+
+        return feedback_message, debug_info, per, bar
+
+def count_reps(joint_angle_series):
+    """Re-scores a recorded session: maps angle names to per-frame arrays, returns counts and rep frames."""
+    elbow_angle = (np.asarray(joint_angle_series['left_elbow_angle'], dtype=np.float64) +
+                   np.asarray(joint_angle_series['right_elbow_angle'], dtype=np.float64)) / 2
+    hip_angle = (np.asarray(joint_angle_series['left_hip_angle_pushup'], dtype=np.float64) +
+                 np.asarray(joint_angle_series['right_hip_angle_pushup'], dtype=np.float64)) / 2
+    trace = create_rep_engine().run(elbow_angle)
+    rep_frames = trace["reps"][trace["full"]]
+    straight = is_straight(hip_angle[rep_frames])
+    return {
+        "correct": int(straight.sum()),
+        "incorrect": int((~straight).sum()),
+        "rep_frames": rep_frames.tolist(),
+        "states": trace["states"],
+    }
+
+# Shared analyzer for single-trainee callers of analyze_pushup
+default_analyzer = PushupAnalyzer()
 
-    return feedback_message, debug_info, per, bar
+def analyze_pushup(joint_angles):
+    return default_analyzer.analyze(joint_angles)
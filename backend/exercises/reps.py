@@ -0,0 +1,78 @@
+from collections import deque
+import numpy as np
+
+UNKNOWN = -1
+
+
+class RepEngine:
+    """Rep-counting state machine over one driving joint angle.
+
+    `classify(angles)` maps an array of angles to indices into `states`, or
+    UNKNOWN for angles that fall outside every state; unknown frames are ignored.
+    Repeated states are merged, and a rep ends every time the trace enters `top`
+    from another state. The rep is full when `bottom` is among the last `window`
+    merged states, so a shallow rep can still be told apart from a complete one.
+
+    `update(angle)` advances one frame for live streams; `run(angles)` labels a
+    whole recorded series in one vectorized pass and finds the same reps.
+    """
+
+    def __init__(self, states, classify, top, bottom, window=3):
+        self.states = list(states)
+        self.classify = classify
+        self.top = self.states.index(top)
+        self.bottom = self.states.index(bottom)
+        self.window = window
+        self.recent = deque(maxlen=window)
+
+    def reset(self):
+        self.recent.clear()
+
+    def label(self, angles):
+        return np.asarray(self.classify(np.asarray(angles, dtype=np.float64)), dtype=np.intp)
+
+    @property
+    def state(self):
+        return self.states[self.recent[-1]] if self.recent else None
+
+    @property
+    def prev_state(self):
+        return self.states[self.recent[-2]] if len(self.recent) >= 2 else None
+
+    def update(self, angle):
+        """Returns (state name, rep) where rep is None, or True/False for a full/partial rep."""
+        code = int(self.label([angle])[0])
+        if code == UNKNOWN:
+            return 'unknown', None
+        rep = None
+        if not self.recent or code != self.recent[-1]:
+            had_previous = bool(self.recent)
+            self.recent.append(code)
+            if code == self.top and had_previous:
+                rep = self.bottom in self.recent
+        return self.states[code], rep
+
+    def run(self, angles):
+        """Labels a series of angles; returns states, merged transitions and rep boundaries."""
+        codes = self.label(angles)
+        known = np.flatnonzero(codes != UNKNOWN)
+        merged = codes[known]
+        change = np.ones(len(merged), dtype=bool)
+        change[1:] = merged[1:] != merged[:-1]
+        transitions = known[change]
+        merged = merged[change]
+
+        # Bottom reached within the trailing window of merged states, via a running count
+        hits = np.concatenate(([0], np.cumsum(merged == self.bottom)))
+        i = np.arange(len(merged))
+        full = hits[i + 1] - hits[np.maximum(0, i - self.window + 1)] > 0
+
+        ends = merged == self.top
+        ends[:1] = False
+        return {
+            "states": codes,
+            "transitions": transitions,
+            "merged": merged,
+            "reps": transitions[ends],
+            "full": full[ends],
+        }
@@ -1,5 +1,6 @@
 import numpy as np
 from time import time
+from exercises.reps import RepEngine, UNKNOWN
 
 # Configuration
 STATE_THRESH = {
@@ -16,12 +17,13 @@ FEEDBACK_THRESH = {
 }
 INACTIVE_THRESH = 15  # Seconds
 
-# Global variables
-correct_count = 0
-incorrect_count = 0
-state_sequence = []
-last_active_time = time()
-last_feedback_time = 0
+# Joint angles this analyzer reads (see joint_angles.JOINT_TRIPLES)
+JOINT_ANGLES = (
+    'left_hip_angle_squat', 'right_hip_angle_squat',
+    'left_knee_angle', 'right_knee_angle',
+    'back_angle'
+)
+
 FEEDBACK_COOLDOWN = 3  # Seconds
 
 def get_state(hip_angle):
@@ -33,6 +35,20 @@ def get_state(hip_angle):
         return 's3'
     return 'unknown'
 
+def classify_states(hip_angle):
+    # Vectorized get_state: indices into SQUAT_STATES, UNKNOWN outside every band
+    return np.select(
+        [hip_angle >= STATE_THRESH['s1'],
+         (STATE_THRESH['s2'][0] <= hip_angle) & (hip_angle < STATE_THRESH['s2'][1]),
+         (STATE_THRESH['s3'][0] <= hip_angle) & (hip_angle < STATE_THRESH['s3'][1])],
+        [0, 1, 2], default=UNKNOWN)
+
+SQUAT_STATES = ('s1', 's2', 's3')
+
+def create_rep_engine():
+    # A rep ends on returning to s1; it is correct if s3 was among the last three states
+    return RepEngine(SQUAT_STATES, classify_states, top='s1', bottom='s3', window=3)
+
 def get_feedback(shoulder_angle, hip_angle, knee_angle, back_angle, current_state, prev_state):
     feedback = []
 
@@ -51,64 +67,83 @@ def get_feedback(shoulder_angle, hip_angle, knee_angle, back_angle, current_stat
 
     return ". ".join(feedback)
 
-def analyze_squat(joint_angles):
-    global correct_count, incorrect_count, state_sequence, last_active_time, last_feedback_time
-
-    left_hip_angle_squat = joint_angles['left_hip_angle_squat']
-    right_hip_angle_squat = joint_angles['right_hip_angle_squat']
-    left_knee_angle = joint_angles['left_knee_angle']
-    right_knee_angle = joint_angles['right_knee_angle']
-    back_angle = joint_angles['back_angle']
-
-    # Use average of left and right for symmetry
-    hip_angle = (left_hip_angle_squat + right_hip_angle_squat) / 2
-    knee_angle = (left_knee_angle + right_knee_angle) / 2
-
-    # Get current state
-    current_state = get_state(hip_angle)
-
-    # Update state sequence
-    if current_state != 'unknown':
-        if not state_sequence or current_state != state_sequence[-1]:
-            state_sequence.append(current_state)
-        if len(state_sequence) > 3:
-            state_sequence.pop(0)
-
-    # Count reps and reset state sequence
-    if current_state == 's1' and len(state_sequence) >= 2:
-        if 's3' in state_sequence:
-            correct_count += 1
+class SquatAnalyzer:
+    """Rep counter and form checker for one trainee; all state lives on the instance."""
+
+    def __init__(self):
+        self.correct_count = 0
+        self.incorrect_count = 0
+        self.reps = create_rep_engine()
+        self.last_active_time = time()
+        self.last_feedback_time = 0
+
+    def analyze(self, joint_angles):
+        left_hip_angle_squat = joint_angles['left_hip_angle_squat']
+        right_hip_angle_squat = joint_angles['right_hip_angle_squat']
+        left_knee_angle = joint_angles['left_knee_angle']
+        right_knee_angle = joint_angles['right_knee_angle']
+        back_angle = joint_angles['back_angle']
+
+        # Use average of left and right for symmetry
+        hip_angle = (left_hip_angle_squat + right_hip_angle_squat) / 2
+        knee_angle = (left_knee_angle + right_knee_angle) / 2
+
+        # Advance the rep state machine and count completed reps
+        current_state, rep = self.reps.update(hip_angle)
+        if rep is not None:
+            if rep:
+                self.correct_count += 1
+            else:
+                self.incorrect_count += 1
+
+        # Get feedback
+        prev_state = self.reps.prev_state or 's1'
+        feedback = get_feedback(0, hip_angle, knee_angle, back_angle, current_state, prev_state)
+
+        # Check for inactivity
+        current_time = time()
+        if current_time - self.last_active_time > INACTIVE_THRESH:
+            self.correct_count = 0
+            self.incorrect_count = 0
+            self.reps.reset()
+            feedback = "Inactive for too long. Counters reset."
+        self.last_active_time = current_time
+
+        # Prepare debug info
+        debug_info = f"State: {current_state}, Hip: {hip_angle:.1f}°, Knee: {knee_angle:.1f}°, Back: {back_angle:.1f}°"
+
+        # Calculate percentage for progress bar
+        per = np.interp(hip_angle, (STATE_THRESH['s3'][0], STATE_THRESH['s1']), (100, 0))
+        bar = np.interp(hip_angle, (STATE_THRESH['s3'][0], STATE_THRESH['s1']), (50, 380))
+
+        # Throttle feedback
+        if current_time - self.last_feedback_time > FEEDBACK_COOLDOWN and feedback:
+            self.last_feedback_time = current_time
+            print(f"Back Angle: {back_angle:.2f}")
+            print(f"Knee Angle: {knee_angle:.2f}")
+            return f"Rep count: {self.correct_count} (Incorrect: {self.incorrect_count}). {feedback}", debug_info, per, bar
         else:
-            incorrect_count += 1
-        state_sequence = []
-
-    # Get feedback
-    prev_state = state_sequence[-2] if len(state_sequence) >= 2 else 's1'
-    feedback = get_feedback(0, hip_angle, knee_angle, back_angle, current_state, prev_state)
-
-    # Check for inactivity
-    current_time = time()
-    if current_time - last_active_time > INACTIVE_THRESH:
-        correct_count = 0
-        incorrect_count = 0
-        state_sequence = []
-        feedback = "Inactive for too long. Counters reset."
-    last_active_time = current_time
-
-    # Prepare debug info
-    debug_info = f"State: {current_state}, Hip: {hip_angle:.1f}°, Knee: {knee_angle:.1f}°, Back: {back_angle:.1f}°"
-
-    # Calculate percentage for progress bar
-    per = np.interp(hip_angle, (STATE_THRESH['s3'][0], STATE_THRESH['s1']), (100, 0))
-    bar = np.interp(hip_angle, (STATE_THRESH['s3'][0], STATE_THRESH['s1']), (50, 380))
-
-    # Throttle feedback
-    if current_time - last_feedback_time > FEEDBACK_COOLDOWN and feedback:
-        last_feedback_time = current_time
-        print(f"Back Angle: {back_angle:.2f}")
-        print(f"Knee Angle: {knee_angle:.2f}")
-        return f"Rep count: {correct_count} (Incorrect: {incorrect_count}). {feedback}", debug_info, per, bar
-    else:
-        return "", debug_info, per, bar
+            return "", debug_info, per, bar
+
+def count_reps(joint_angle_series):
+    """Re-scores a recorded session: maps angle names to per-frame arrays, returns counts and rep frames.
+
+    The inactivity reset of the live analyzer is not applied.
+    """
+    hip_angle = (np.asarray(joint_angle_series['left_hip_angle_squat'], dtype=np.float64) +
+                 np.asarray(joint_angle_series['right_hip_angle_squat'], dtype=np.float64)) / 2
+    trace = create_rep_engine().run(hip_angle)
+    return {
+        "correct": int(trace["full"].sum()),
+        "incorrect": int((~trace["full"]).sum()),
+        "rep_frames": trace["reps"].tolist(),
+        "states": trace["states"],
+    }
+
+# Shared analyzer for single-trainee callers of analyze_squat
+default_analyzer = SquatAnalyzer()
+
+def analyze_squat(joint_angles):
+    return default_analyzer.analyze(joint_angles)
 
 print("Squat analysis function initialized. Ready to analyze squat form.")
\ No newline at end of file
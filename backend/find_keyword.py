@@ -3,64 +3,173 @@ import queue
 import threading
 from vosk import Model, KaldiRecognizer
 import json
-import requests
+from functools import partial
 import os
-import wget
 import zipfile
-from openai import OpenAI
 from dotenv import load_dotenv
+from flask import Flask, jsonify
 import time
-import numpy as np
-from collections import deque
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bounded_queue import DropOldestQueue
+from vad import VoiceActivityGate
+from intent_classifier import IntentClassifier
+from http_outbox import HttpOutbox
 
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=OPENAI_API_KEY)
+MODEL_PATH = os.getenv('VOSK_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+MODEL_REQUIRED_FILES = ["am/final.mdl", "conf/model.conf"]
+ALLOW_MODEL_DOWNLOAD = os.getenv('VOSK_ALLOW_DOWNLOAD', '0') == '1'
+STATUS_PORT = int(os.getenv('KEYWORD_STATUS_PORT', 5006))
+
+_openai_client = None
+_openai_lock = threading.Lock()
 
 CATEGORIES = ["coherent_english", "fitness_form", "incoherent"]
+CATEGORY_CACHE_SIZE = 256  # remote classifications remembered per normalized utterance
+
+intent_classifier = IntentClassifier()
+category_cache = OrderedDict()
+category_cache_lock = threading.Lock()
+# Remote classification runs off the detector thread so recognition never waits on it
+categorize_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="categorize")
+# Actions are delivered in the background; /start_capture alone blocks for several seconds
+action_outbox = HttpOutbox(maxsize=16, workers=2, timeout=15, retries=0, name="actions")
 
 # Constants for audio processing
 RATE = 16000
 CHUNK = 1024
 MIN_PHRASE_LENGTH = 3
 SILENCE_THRESHOLD = 500
+SPEECH_STOP_THRESHOLD = 300  # lower RMS level that keeps an utterance open (hysteresis)
+VAD_HANGOVER = 0.4  # seconds of quiet before the gate closes and the recognizer is flushed
+VAD_SPECTRAL = os.getenv('VAD_SPECTRAL', '0') == '1'
+RECOGNIZER_MODE = os.getenv('RECOGNIZER_MODE', 'dual')  # 'dual' (command grammar first) or 'full'
+COMMAND_PHRASES_FILE = os.getenv('COMMAND_PHRASES_FILE')  # optional file, one phrase per line
+MAX_COMMAND_SECONDS = 4.0  # longer utterances go straight to the full recognizer
+
+# Command vocabulary decoded by the grammar-constrained recognizer
+COMMAND_PHRASES = [
+    "how is my form", "how's my form", "how does my form look", "check my form",
+    "how are my squats", "how does my squat look", "am i doing it right",
+    "is my back straight", "squats", "push ups", "plank", "start", "stop",
+    "next exercise", "how many reps",
+]
 MIN_CONFIDENCE_THRESHOLD = 0.7
 SLIDING_WINDOW_SIZE = 5
 END_OF_SPEECH_SILENCE_DURATION = 1.0  # seconds of silence to mark end of speech
 PROCESSING_TIMEOUT = 5.0  # seconds to wait before processing anyway
+AUDIO_QUEUE_CHUNKS = 64  # ~4 s of audio buffered before the oldest chunks are dropped
+MAX_BATCH_CHUNKS = 8  # chunks fed to the recognizer per AcceptWaveform call
+IDLE_WAKEUP = 0.25  # seconds between end-of-speech checks when no audio arrives
 
-def download_model():
+def get_openai_client():
+    # Imported and configured on first use so startup does not pay for it
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            load_dotenv()
+            _openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        return _openai_client
+
+def download_model(model_path=MODEL_PATH):
+    import wget
     model_url = "https://alphacephei.com/vosk/models/vosk-model-en-us-0.22.zip"
-    model_path = "model"
-    zip_path = "model.zip"
-
-    if not os.path.exists(model_path):
-        print("Downloading the Vosk model...")
-        wget.download(model_url, zip_path)
-        print("\nExtracting the model...")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(".")
-        extracted_folders = [name for name in os.listdir('.') if name.startswith("vosk-model")]
-        if extracted_folders:
-            os.rename(extracted_folders[0], model_path)
-        else:
-            raise Exception("Vosk model folder not found after extraction.")
-        os.remove(zip_path)
-        print("Model downloaded and extracted successfully.")
+    parent = os.path.dirname(os.path.abspath(model_path))
+    zip_path = os.path.join(parent, "model.zip")
+
+    print("Downloading the Vosk model...")
+    wget.download(model_url, zip_path)
+    print("\nExtracting the model...")
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(parent)
+    extracted_folders = [name for name in os.listdir(parent) if name.startswith("vosk-model")]
+    if extracted_folders:
+        if os.path.exists(model_path):
+            os.rename(model_path, f"{model_path}.incomplete")
+        os.rename(os.path.join(parent, extracted_folders[0]), model_path)
     else:
-        print("Vosk model already exists.")
-
-def is_silence(audio_chunk):
-    """Improved silence detection using RMS with safeguards against invalid values."""
-    audio_array = np.frombuffer(audio_chunk, dtype=np.int16).astype(np.float32)
-    if len(audio_array) == 0:
-        return True
-    squared = np.square(audio_array)
-    mean_squared = np.mean(squared)
-    if mean_squared <= 0:
-        return True
-    rms = np.sqrt(mean_squared)
-    return rms < SILENCE_THRESHOLD
+        raise Exception("Vosk model folder not found after extraction.")
+    os.remove(zip_path)
+    print("Model downloaded and extracted successfully.")
+
+class ModelBootstrap:
+    """Loads the Vosk model and the OpenAI client in the background.
+
+    The model directory is validated locally, so a complete `backend/model` tree
+    starts without any network access; downloading is opt-in. `timings` records
+    seconds from startup to each milestone, up to the first recognized word.
+    """
+
+    def __init__(self, model_path=MODEL_PATH):
+        self.model_path = model_path
+        self.started = time.time()
+        self.model = None
+        self.error = None
+        self.timings = {}
+        self.ready = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._load, daemon=True)
+                self.thread.start()
+        return self
+
+    def missing_files(self):
+        missing = [f for f in MODEL_REQUIRED_FILES if not os.path.exists(os.path.join(self.model_path, f))]
+        graph = os.path.join(self.model_path, "graph")
+        if not any(os.path.exists(os.path.join(graph, f)) for f in ("HCLG.fst", "HCLr.fst")):
+            missing.append("graph/HCLG.fst or graph/HCLr.fst")
+        return missing
+
+    def _load(self):
+        try:
+            missing = self.missing_files()
+            if missing:
+                if not ALLOW_MODEL_DOWNLOAD:
+                    raise RuntimeError(f"Vosk model at {self.model_path} is incomplete (missing {', '.join(missing)}); "
+                                       "set VOSK_ALLOW_DOWNLOAD=1 to fetch it")
+                download_model(self.model_path)
+            self.model = Model(self.model_path)
+            self.mark("model_loaded")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error loading Vosk model: {e}")
+        finally:
+            self.ready.set()
+        try:
+            get_openai_client()
+            self.mark("openai_ready")
+        except Exception as e:
+            print(f"Error creating OpenAI client: {e}")
+
+    def mark(self, milestone):
+        if milestone not in self.timings:
+            self.timings[milestone] = round(time.time() - self.started, 3)
+            print(f"[startup] {milestone} after {self.timings[milestone]:.3f}s")
+
+    def wait(self, timeout=None):
+        self.ready.wait(timeout)
+        return self.model
+
+    def status(self):
+        return {
+            "ready": self.model is not None,
+            "error": self.error,
+            "model_path": self.model_path,
+            "timings": dict(self.timings),
+        }
+
+bootstrap = ModelBootstrap()
+status_app = Flask(__name__)
+
+@status_app.route('/ready', methods=['GET'])
+def ready():
+    status = bootstrap.status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 def audio_stream(q):
     p = pyaudio.PyAudio()
@@ -79,6 +188,7 @@ def audio_stream(q):
         while True:
             try:
                 data = stream.read(CHUNK, exception_on_overflow=False)
+                bootstrap.mark("first_audio")
                 q.put((data, time.time()))  # Add timestamp to each chunk
             except Exception as e:
                 print(f"Error reading audio stream: {e}")
@@ -89,17 +199,25 @@ def audio_stream(q):
         stream.close()
         p.terminate()
 
+def report_action(category, response, error):
+    # Failures are already logged by the outbox
+    if error is None:
+        print(f"Request sent successfully for category: '{category}'")
+        print(f"Response: {response.text}")
+
 def trigger_action(category, text):
     action_map = {
         "fitness_form": {
             "url": "http://localhost:5001/start_capture",
             "headers": {"Content-Type": "application/json"},
-            "payload": lambda t: {"user_query": t}
+            "payload": lambda t: {"user_query": t},
+            "coalesce": True
         },
         "coherent_english": {
             "url": "http://localhost:8080/prompt",
             "headers": {"Content-Type": "application/json"},
-            "payload": lambda t: {"prompt": t}
+            "payload": lambda t: {"prompt": t},
+            "coalesce": False
         }
     }
 
@@ -108,18 +226,10 @@ def trigger_action(category, text):
         print(f"No action defined for category: {category}")
         return
 
-    try:
-        payload = action["payload"](text)
-        response = requests.post(action["url"], headers=action["headers"], json=payload)
-        
-        if response.status_code == 200:
-            print(f"Request sent successfully for category: '{category}'")
-            print(f"Response: {response.json()}")
-        else:
-            print(f"Failed to send request for category '{category}'. Status code: {response.status_code}")
-            print(f"Response: {response.text}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending request for category '{category}': {e}")
+    # Repeated form checks collapse into one pending capture; questions are all kept
+    action_outbox.post(action["url"], action["payload"](text), headers=action["headers"],
+                       callback=partial(report_action, category),
+                       key=category if action["coalesce"] else None)
 
 def categorize_input(text):
     messages = [
@@ -155,7 +265,7 @@ def categorize_input(text):
     ]
 
     try:
-        completion = client.chat.completions.create(
+        completion = get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=messages,
             max_tokens=5,
@@ -169,85 +279,179 @@ def categorize_input(text):
         print(f"Error in categorization: {e}")
         return None
 
-def process_speech(full_text):
-    print(f"\nProcessing: {full_text}")
-    category = categorize_input(full_text)
+def categorize_cached(text):
+    key = " ".join(text.lower().split())
+    with category_cache_lock:
+        if key in category_cache:
+            category_cache.move_to_end(key)
+            return category_cache[key]
+    category = categorize_input(text)
+    if category is not None:
+        with category_cache_lock:
+            category_cache[key] = category
+            if len(category_cache) > CATEGORY_CACHE_SIZE:
+                category_cache.popitem(last=False)
+    return category
+
+def handle_category(category, text):
     if category in ["coherent_english", "fitness_form"]:
         print(f"Category '{category}' detected!")
-        trigger_action(category, full_text)
+        trigger_action(category, text)
     else:
         print("Input is incoherent or not relevant.")
 
-def keyword_detector(q, model_path="model"):
-    if not os.path.exists(model_path):
-        download_model()
-
+def categorize_remote(text):
     try:
-        model = Model(model_path)
+        handle_category(categorize_cached(text), text)
     except Exception as e:
-        print(f"Error loading Vosk model: {e}")
+        print(f"Error handling remote categorization: {e}")
+
+def process_speech(full_text):
+    print(f"\nProcessing: {full_text}")
+    category = intent_classifier.classify(full_text)
+    if category is not None:
+        handle_category(category, full_text)
+    else:
+        print("Ambiguous input, deferring to remote classifier.")
+        categorize_executor.submit(categorize_remote, full_text)
+
+def load_command_phrases():
+    if COMMAND_PHRASES_FILE:
+        try:
+            with open(COMMAND_PHRASES_FILE) as f:
+                return [line.strip().lower() for line in f if line.strip()]
+        except OSError as e:
+            print(f"Error reading command phrases: {e}")
+    return COMMAND_PHRASES
+
+def create_command_recognizer(model, model_path):
+    # Runtime grammars need a model with a dynamic graph (the small models ship HCLr.fst)
+    if RECOGNIZER_MODE != 'dual':
+        return None
+    if not os.path.exists(os.path.join(model_path, "graph", "HCLr.fst")):
+        print("Model does not support grammars, using the full recognizer only.")
+        return None
+    grammar = json.dumps(load_command_phrases() + ["[unk]"])
+    command_recognizer = KaldiRecognizer(model, RATE, grammar)
+    command_recognizer.SetWords(True)
+    return command_recognizer
+
+def read_command(result_json):
+    # Returns the grammar transcript, "" for no speech, or None if the grammar rejected it
+    result = json.loads(result_json)
+    words = result.get('result', [])
+    if any(word['word'] == '[unk]' or word['conf'] < MIN_CONFIDENCE_THRESHOLD for word in words):
+        return None
+    return ' '.join(word['word'] for word in words)
+
+def keyword_detector(q, loader=bootstrap):
+    # Audio keeps queueing while the model finishes loading in the background
+    model = loader.start().wait()
+    if model is None:
         return
 
     recognizer = KaldiRecognizer(model, RATE)
     recognizer.SetWords(True)
+    command_recognizer = create_command_recognizer(model, loader.model_path)
+    utterance = bytearray()  # Voiced audio of the current utterance, kept for a full-model retry
+    command_segments = []
+    full_mode = command_recognizer is None
+    gate = VoiceActivityGate(rate=RATE, chunk=CHUNK, start_threshold=SILENCE_THRESHOLD,
+                             stop_threshold=SPEECH_STOP_THRESHOLD, hangover=VAD_HANGOVER,
+                             spectral=VAD_SPECTRAL)
 
     sliding_window = deque(maxlen=SLIDING_WINDOW_SIZE)
-    silence_start = None
     last_process_time = time.time()
     accumulated_text = ""
 
+    reported_drops = 0
+
+    def read_words(result_json):
+        try:
+            result = json.loads(result_json)
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            return ""
+        words = [word for word in result.get('result', []) if word['conf'] >= MIN_CONFIDENCE_THRESHOLD]
+        return ' '.join(word['word'] for word in words)
+
     while True:
-        if not q.empty():
-            data, timestamp = q.get()
-            if recognizer.AcceptWaveform(data):
-                try:
-                    result = json.loads(recognizer.Result())
-                    if 'result' in result:
-                        words = [word for word in result['result'] if word['conf'] >= MIN_CONFIDENCE_THRESHOLD]
-                        if words:
-                            text = ' '.join(word['word'] for word in words)
-                            sliding_window.append(text)
-                            accumulated_text += " " + text
-                            silence_start = None  # Reset silence start time
-                            last_process_time = timestamp  # Update last process time
-                        else:
-                            if silence_start is None:
-                                silence_start = timestamp
+        try:
+            batch = q.drain(MAX_BATCH_CHUNKS, timeout=IDLE_WAKEUP)
+        except queue.Empty:
+            if q.closed:
+                break
+            batch = None
+
+        if batch:
+            # Only voiced audio (plus pre-roll and hangover) reaches the recognizer
+            voiced, ended = gate.process([chunk for chunk, _ in batch], [ts for _, ts in batch])
+            text = ""
+            if voiced and full_mode:
+                if recognizer.AcceptWaveform(b''.join(voiced)):
+                    text = read_words(recognizer.Result())
+                else:
+                    partial = json.loads(recognizer.PartialResult())
+                    partial_text = partial.get("partial", "").strip()
+                    if partial_text:
+                        loader.mark("first_word")
+                        print(f"Partial: {partial_text}", end="\r")
+            elif voiced:
+                # Fast path: decode against the command grammar only
+                data = b''.join(voiced)
+                utterance.extend(data)
+                if command_recognizer.AcceptWaveform(data):
+                    command_segments.append(read_command(command_recognizer.Result()))
+                if None in command_segments or len(utterance) > RATE * 2 * MAX_COMMAND_SECONDS:
+                    # Not a command: replay the utterance through the full model and stream from here
+                    command_recognizer.Reset()
+                    full_mode = True
+                    if recognizer.AcceptWaveform(bytes(utterance)):
+                        text = read_words(recognizer.Result())
+                    utterance.clear()
+                    command_segments.clear()
+            if ended:
+                # Flush the decoder at the end of the utterance instead of feeding it silence
+                if full_mode:
+                    text = (text + " " + read_words(recognizer.FinalResult())).strip()
+                else:
+                    command_segments.append(read_command(command_recognizer.FinalResult()))
+                    if None in command_segments:
+                        recognizer.AcceptWaveform(bytes(utterance))
+                        text = read_words(recognizer.FinalResult())
                     else:
-                        if silence_start is None:
-                            silence_start = timestamp
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}")
-                except Exception as e:
-                    print(f"Error processing recognition result: {e}")
-            else:
-                partial = json.loads(recognizer.PartialResult())
-                partial_text = partial.get("partial", "").strip()
-                if partial_text:
-                    print(f"Partial: {partial_text}", end="\r")
-                elif silence_start is None:
-                    silence_start = timestamp
-
-            # Check for end of speech or timeout
-            current_time = time.time()
-            if silence_start and (current_time - silence_start >= END_OF_SPEECH_SILENCE_DURATION):
-                if accumulated_text.strip():
-                    process_speech(accumulated_text.strip())
-                    accumulated_text = ""
-                silence_start = None
-                last_process_time = current_time
-            elif current_time - last_process_time >= PROCESSING_TIMEOUT:
-                if accumulated_text.strip():
-                    process_speech(accumulated_text.strip())
-                    accumulated_text = ""
-                silence_start = None
-                last_process_time = current_time
-
-        else:
-            time.sleep(0.1)  # Prevent busy waiting
+                        text = ' '.join(segment for segment in command_segments if segment)
+                    utterance.clear()
+                    command_segments.clear()
+                full_mode = command_recognizer is None
+            if text:
+                loader.mark("first_word")
+                sliding_window.append(text)
+                accumulated_text += " " + text
+                last_process_time = batch[-1][1]
+
+            if q.dropped != reported_drops:
+                print(f"Audio queue overflow: dropped {q.dropped - reported_drops} chunks")
+                reported_drops = q.dropped
+
+        # End of speech is measured from the last voiced chunk the gate saw
+        current_time = time.time()
+        silence_start = None if gate.active else gate.last_voice
+        if accumulated_text.strip() and silence_start and (current_time - silence_start >= END_OF_SPEECH_SILENCE_DURATION):
+            process_speech(accumulated_text.strip())
+            accumulated_text = ""
+            last_process_time = current_time
+        elif current_time - last_process_time >= PROCESSING_TIMEOUT:
+            if accumulated_text.strip():
+                process_speech(accumulated_text.strip())
+                accumulated_text = ""
+            last_process_time = current_time
 
 def main():
-    q = queue.Queue()
+    bootstrap.start()
+    threading.Thread(target=status_app.run, kwargs={"port": STATUS_PORT, "use_reloader": False},
+                     daemon=True).start()
+    q = DropOldestQueue(maxsize=AUDIO_QUEUE_CHUNKS)
 
     audio_thread = threading.Thread(target=audio_stream, args=(q,), daemon=True)
     detector_thread = threading.Thread(target=keyword_detector, args=(q,), daemon=True)
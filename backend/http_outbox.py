@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpOutbox:
+    """Fire-and-forget JSON POSTs delivered by background workers.
+
+    Requests go through one keep-alive `requests.Session`, each with a timeout
+    and a few retries with exponential backoff. The outbox is bounded: when it is
+    full the oldest pending message is dropped, so callers never block. Messages
+    posted with the same `key` coalesce: a newer one replaces the one still waiting.
+    `callback(response, error)` runs on the worker thread once delivery finishes.
+    """
+
+    def __init__(self, maxsize=32, workers=1, timeout=5, retries=2, backoff=0.5, name="outbox"):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.name = name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 4))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.pending = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def post(self, url, payload, headers=None, callback=None, key=None):
+        with self.cond:
+            if key is not None:
+                stale = [item for item in self.pending if item[0] == key]
+                for item in stale:
+                    self.pending.remove(item)
+                self.dropped += len(stale)
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+                print(f"[{self.name}] Outbox full, dropping oldest message")
+            self.pending.append((key, url, payload, headers, callback))
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {"pending": len(self.pending), "sent": self.sent, "failed": self.failed, "dropped": self.dropped}
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                key, url, payload, headers, callback = self.pending.popleft()
+            response, error = self._deliver(url, payload, headers)
+            with self.cond:
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            if error is not None:
+                print(f"[{self.name}] Failed to POST to {url}: {error}")
+            if callback:
+                try:
+                    callback(response, error)
+                except Exception as e:
+                    print(f"[{self.name}] Callback error: {e}")
+
+    def _deliver(self, url, payload, headers):
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                return response, None
+            except requests.RequestException as e:
+                error = e
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return None, error
@@ -0,0 +1,192 @@
+import atexit
+import multiprocessing as mp_proc
+import queue
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+
+NUM_LANDMARKS = 33
+LANDMARK_FIELDS = 4  # x, y, z, visibility
+MAX_FRAME_BYTES = 1920 * 1080 * 3
+MAX_TRACKERS = 8  # per worker; the least recently used stream's tracker is closed beyond this
+
+
+def _worker_main(conn, frame_name, result_name, detection_con, track_con):
+    # Runs in a child process; MediaPipe is imported here so the parent can stay light
+    import mediapipe as mp
+
+    frame_shm = shared_memory.SharedMemory(name=frame_name)
+    result_shm = shared_memory.SharedMemory(name=result_name)
+    result = np.ndarray((NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32, buffer=result_shm.buf)
+    # One tracker per (stream key, complexity) so streams never share temporal state;
+    # unkeyed calls are independent images and use static_image_mode instances
+    poses = OrderedDict()
+    img = None
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            shape, key, complexity = msg
+            slot = (key, complexity)
+            try:
+                if slot not in poses:
+                    poses[slot] = mp.solutions.pose.Pose(static_image_mode=key is None, model_complexity=complexity,
+                                                         smooth_landmarks=key is not None,
+                                                         min_detection_confidence=detection_con,
+                                                         min_tracking_confidence=track_con)
+                    if len(poses) > MAX_TRACKERS:
+                        _, evicted = poses.popitem(last=False)
+                        evicted.close()
+                poses.move_to_end(slot)
+                img = np.ndarray(shape, dtype=np.uint8, buffer=frame_shm.buf)
+                results = poses[slot].process(img)
+                found = results.pose_landmarks is not None
+                if found:
+                    for i, lm in enumerate(results.pose_landmarks.landmark):
+                        result[i] = (lm.x, lm.y, lm.z, lm.visibility)
+            except Exception as e:
+                # A bad frame must not take the worker down with it; report no pose instead
+                print(f"Pose worker error: {e}")
+                found = False
+            conn.send(found)
+    finally:
+        img = result = None
+        for pose in poses.values():
+            pose.close()
+        frame_shm.close()
+        result_shm.close()
+
+
+class InferenceWorker:
+    """One MediaPipe child process and its shared-memory slots.
+
+    If the child dies (e.g. MediaPipe crashes hard), the frame in flight gets no
+    result and a fresh child is started on the same shared memory.
+    """
+
+    def __init__(self, ctx, max_frame_bytes, detection_con, track_con):
+        self.ctx = ctx
+        self.max_frame_bytes = max_frame_bytes
+        self.detection_con = detection_con
+        self.track_con = track_con
+        self.frame_shm = shared_memory.SharedMemory(create=True, size=max_frame_bytes)
+        self.result_shm = shared_memory.SharedMemory(create=True, size=NUM_LANDMARKS * LANDMARK_FIELDS * 4)
+        self.result = np.ndarray((NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32, buffer=self.result_shm.buf)
+        self.conn = self.process = None
+        self.start()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_worker_main, daemon=True,
+                                        args=(child_conn, self.frame_shm.name, self.result_shm.name,
+                                              self.detection_con, self.track_con))
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=2)
+        print(f"Pose worker {self.process.pid} died (exit code {self.process.exitcode}); restarting")
+        self.start()
+
+    def infer(self, imgRGB, key, complexity):
+        if imgRGB.nbytes > self.max_frame_bytes:
+            raise ValueError(f"Frame of {imgRGB.nbytes} bytes exceeds the shared buffer ({self.max_frame_bytes})")
+        if not self.process.is_alive():
+            self.restart()
+        frame = np.ndarray(imgRGB.shape, dtype=np.uint8, buffer=self.frame_shm.buf)
+        frame[...] = imgRGB
+        try:
+            self.conn.send((imgRGB.shape, key, complexity))
+            found = self.conn.recv()
+        except (EOFError, OSError):
+            self.restart()
+            return None
+        return self.result.copy() if found else None
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.result = None
+        self.frame_shm.close()
+        self.frame_shm.unlink()
+        self.result_shm.close()
+        self.result_shm.unlink()
+
+
+class PoseInferenceService:
+    """Keeps `num_workers` warm MediaPipe Pose instances in child processes.
+
+    Frames are written into a per-worker shared-memory slot and landmarks come back
+    as a 33x4 float32 array (x, y, z, visibility), so nothing is pickled per frame
+    and inference runs outside the caller's GIL. Calls with the same `key` (one
+    video stream) stick to one worker, which keeps a separate tracker per key, so
+    MediaPipe's temporal tracking stays valid even when streams share a worker.
+    Calls without a key take whichever worker is free and are processed as
+    independent images.
+    """
+
+    def __init__(self, num_workers=2, max_frame_bytes=MAX_FRAME_BYTES, detection_con=0.5, track_con=0.5):
+        ctx = mp_proc.get_context('spawn')
+        self.workers = [InferenceWorker(ctx, max_frame_bytes, detection_con, track_con)
+                        for _ in range(num_workers)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.closed = False
+        atexit.register(self.close)
+
+    def infer(self, imgRGB, key=None, complexity=1):
+        if key is not None:
+            worker = self.workers[hash(key) % len(self.workers)]
+            with worker.lock:
+                return worker.infer(imgRGB, key, complexity)
+
+        worker = self.idle.get()
+        try:
+            with worker.lock:
+                return worker.infer(imgRGB, None, complexity)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for worker in self.workers:
+            worker.close()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(num_workers):
+    # Process-wide service started on first use; None keeps MediaPipe in the caller's process
+    global _service
+    if num_workers <= 0:
+        return None
+    with _service_lock:
+        if _service is None:
+            _service = PoseInferenceService(num_workers=num_workers)
+        return _service
+
+
+def to_landmark_list(points):
+    # Rebuild a MediaPipe NormalizedLandmarkList so drawing_utils and findPosition work unchanged
+    from mediapipe.framework.formats import landmark_pb2
+
+    landmarks = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in points.tolist():
+        landmarks.landmark.add(x=x, y=y, z=z, visibility=visibility)
+    return landmarks
@@ -0,0 +1,60 @@
+import re
+
+# Keywords that tie an utterance to exercise form; at least one is needed for fitness_form
+FORM_KEYWORDS = [
+    r"\bform\b", r"\bposture\b", r"\btechnique\b", r"\bback straight\b",
+    r"\b(deep|low) enough\b", r"\bdepth\b",
+]
+BODY_WORDS = r"\b(back|knees?|hips?|elbows?|shoulders?|arms?|legs?|core)\b"
+# Phrasings of a request for feedback; they only count next to a form keyword or exercise
+FEEDBACK_PHRASES = [
+    r"\bhow('?s| is| does| do) my\b", r"\bcheck (my|me|this)\b", r"\b(am i|i'm) doing\b",
+    r"\bdoing (it|this) right\b", r"\bwatch (me|my)\b",
+]
+EXERCISE_WORDS = r"\b(squats?|push ?ups?|pushups?|planks?|deadlifts?|lunges?|bench press)\b"
+QUESTION_STARTS = (
+    "what", "how", "why", "when", "where", "who", "which", "can", "could", "should",
+    "would", "is", "are", "do", "does", "tell", "give", "explain", "i want", "let's",
+    "hello", "hi", "hey", "thanks", "thank you",
+)
+FILLER_WORDS = {"uh", "um", "huh", "hmm", "the", "a", "an", "and", "oh", "ah", "eh", "mm", "yeah", "so"}
+
+
+class IntentClassifier:
+    """Keyword and grammar rules that label an utterance without a model round-trip.
+
+    `classify(text)` returns one of the categorize_input labels when the rules are
+    confident, or None when the utterance is ambiguous and should be sent to the
+    remote classifier.
+    """
+
+    def __init__(self, min_words=3):
+        self.min_words = min_words
+        self.form = [re.compile(p) for p in FORM_KEYWORDS]
+        self.phrases = [re.compile(p) for p in FEEDBACK_PHRASES]
+        self.exercise = re.compile(EXERCISE_WORDS)
+        self.body = re.compile(BODY_WORDS)
+        self.question = re.compile(r"^(?:%s)\b" % "|".join(re.escape(q) for q in QUESTION_STARTS))
+
+    def classify(self, text):
+        text = " ".join(text.lower().split())
+        words = text.split()
+        content = [w for w in words if w not in FILLER_WORDS]
+        if not content:
+            return "incoherent"
+
+        # Anchors name the exercise or the form itself; phrases only ask for feedback
+        form_hits = sum(1 for p in self.form if p.search(text))
+        anchors = form_hits + bool(self.exercise.search(text)) + bool(self.body.search(text))
+        phrase_hits = sum(1 for p in self.phrases if p.search(text))
+        if anchors >= 2 or (anchors and phrase_hits):
+            return "fitness_form"
+        # "are my squats good"; a lone "form" as in "the best form of cardio" is not enough
+        if anchors and "my" in words and self.question.match(text):
+            return "fitness_form"
+
+        if len(content) < 2 or phrase_hits:
+            return None  # "hi", "stop" or "how is my day going" are left to the remote classifier
+        if len(words) >= self.min_words and not form_hits and self.question.match(text):
+            return "coherent_english"
+        return None
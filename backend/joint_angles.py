@@ -0,0 +1,73 @@
+import numpy as np
+
+NUM_LANDMARKS = 33
+
+# (p1, p2, p3) landmark triples; the angle is measured at p2
+JOINT_TRIPLES = {
+    'left_shoulder_angle': (13, 11, 23),
+    'right_shoulder_angle': (14, 12, 24),
+    'left_hip_angle_squat': (11, 23, 25),
+    'right_hip_angle_squat': (12, 24, 26),
+    'left_knee_angle': (23, 25, 27),
+    'right_knee_angle': (24, 26, 28),
+    'left_ankle_angle': (25, 27, 31),
+    'right_ankle_angle': (26, 28, 32),
+    'back_angle': (7, 11, 23),  # Using left side for back angle
+    'left_elbow_angle': (11, 13, 15),
+    'right_elbow_angle': (12, 14, 16),
+    'left_hand_to_shoulder_angle': (15, 13, 11),
+    'right_hand_to_shoulder_angle': (16, 14, 12),
+    # Hip angles for pushups
+    'left_hip_angle_pushup': (11, 23, 27),
+    'right_hip_angle_pushup': (12, 24, 28),
+}
+
+
+class AngleEngine:
+    """Computes a fixed set of joint angles in one batched NumPy pass.
+
+    `triples` maps angle names to (p1, p2, p3) landmark indices. Names that are
+    plain strings are looked up in JOINT_TRIPLES, so exercises can either reuse
+    the shared definitions or declare their own.
+    """
+
+    def __init__(self, triples=None):
+        if triples is None:
+            triples = JOINT_TRIPLES
+        elif not isinstance(triples, dict):
+            triples = {name: JOINT_TRIPLES[name] for name in triples}
+        self.names = list(triples)
+        idx = np.asarray([triples[name] for name in self.names], dtype=np.intp).reshape(-1, 3)
+        self.p1, self.p2, self.p3 = idx[:, 0], idx[:, 1], idx[:, 2]
+        self.min_points = int(idx.max()) + 1 if len(idx) else 0
+
+    def compute(self, points):
+        # points: (..., n_landmarks, >=2) array of x, y; returns (..., n_angles) in degrees
+        points = np.asarray(points, dtype=np.float64)
+        a = points[..., self.p1, :2] - points[..., self.p2, :2]
+        c = points[..., self.p3, :2] - points[..., self.p2, :2]
+        angle = np.degrees(np.arctan2(c[..., 1], c[..., 0]) - np.arctan2(a[..., 1], a[..., 0]))
+        angle = np.mod(angle, 360.0)
+        return np.minimum(angle, 360.0 - angle)
+
+    def angles(self, points):
+        if len(points) < self.min_points:
+            return dict.fromkeys(self.names, 0)
+        return dict(zip(self.names, self.compute(points).tolist()))
+
+
+def new_landmark_array():
+    # Columns: x, y (pixels), z, visibility
+    return np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+
+
+def fill_landmark_array(landmarks, out, w, h):
+    """Writes MediaPipe landmarks into `out` in place, scaling x and y to pixels."""
+    for i, lm in enumerate(landmarks.landmark):
+        out[i, 0] = lm.x
+        out[i, 1] = lm.y
+        out[i, 2] = lm.z
+        out[i, 3] = lm.visibility
+    out[:, 0] *= w
+    out[:, 1] *= h
+    return out
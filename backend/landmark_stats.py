@@ -0,0 +1,56 @@
+import numpy as np
+from joint_angles import NUM_LANDMARKS
+
+
+class LandmarkAggregator:
+    """Constant-memory running statistics over a stream of 33x4 landmark arrays.
+
+    Keeps Welford running means and variances plus per-landmark min/max, updated
+    as each frame arrives, and the last `window` frames in a ring buffer for robust
+    statistics such as the median. Frames with no detected pose are counted as
+    missed and otherwise ignored.
+    """
+
+    def __init__(self, window=90, fields=4):
+        self.window = window
+        self.ring = np.zeros((window, NUM_LANDMARKS, fields), dtype=np.float32)
+        self.mean = np.zeros((NUM_LANDMARKS, fields), dtype=np.float64)
+        self.m2 = np.zeros((NUM_LANDMARKS, fields), dtype=np.float64)
+        self.min = np.full((NUM_LANDMARKS, fields), np.inf)
+        self.max = np.full((NUM_LANDMARKS, fields), -np.inf)
+        self.count = 0
+        self.missed = 0
+
+    def reset(self):
+        self.mean.fill(0)
+        self.m2.fill(0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+        self.count = 0
+        self.missed = 0
+
+    def add(self, points):
+        if points is None:
+            self.missed += 1
+            return
+        self.ring[self.count % self.window] = points
+        self.count += 1
+        delta = points - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (points - self.mean)
+        np.minimum(self.min, points, out=self.min)
+        np.maximum(self.max, points, out=self.max)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - 1)
+
+    def recent(self):
+        return self.ring[:min(self.count, self.window)]
+
+    def median(self):
+        if self.count == 0:
+            return None
+        return np.median(self.recent(), axis=0)
@@ -3,58 +3,184 @@ import mediapipe as mp
 from flask_cors import CORS
 import cv2
 import math
-from exercises.squat import analyze_squat
-from exercises.pushup import analyze_pushup
-from exercises.plank import analyze_plank
+from exercises.squat import SquatAnalyzer
+from exercises.pushup import PushupAnalyzer
+from exercises.plank import PlankAnalyzer
+from exercises import squat, pushup, plank
+from joint_angles import AngleEngine, new_landmark_array, fill_landmark_array
+from pose_scheduler import PoseScheduler
+from http_outbox import HttpOutbox
+from inference_pool import get_service, to_landmark_list
+from pipeline import FramePipeline, FrameBroadcaster, JpegEncoder
 import requests
 import json
 import time
+import threading
+import uuid
+import os
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
 SERVER_PORT = 5001
-current_exercise = 'Squats'  # Default exercise
+DEFAULT_SESSION = 'default'  # Used by clients that don't pass a session id
+POSE_WORKERS = int(os.getenv('POSE_WORKERS', '0'))  # 0 keeps MediaPipe in-process
+COACH_URL = 'http://localhost:8080/prompt'
+# Capture sources clients may open: device indexes and/or stream URLs set by the operator
+ALLOWED_SOURCES = [int(s) if s.strip().isdigit() else s.strip()
+                   for s in os.getenv('CAPTURE_SOURCES', '0').split(',') if s.strip()]
+
+# Keep-alive, bounded dispatcher for coach prompts so the frame loop never waits on HTTP
+coach_outbox = HttpOutbox(maxsize=8, timeout=5, retries=1, name="coach")
+
+def log_coach_prompt(response, error):
+    # Failures are already logged by the outbox
+    if error is None:
+        print(f"Sent POST request to 8080/prompt: {response.request.body.decode()}")
 
 class PoseDetector:
-    def __init__(self):
+    def __init__(self, roi_tracking=False, roi_padding=0.25, inference_width=None, scheduler=None, service=None):
         self.mpDraw = mp.solutions.drawing_utils
         self.mpPose = mp.solutions.pose
-        self.pose = self.mpPose.Pose(static_image_mode=False, model_complexity=1, 
-                                     smooth_landmarks=True, min_detection_confidence=0.5, 
-                                     min_tracking_confidence=0.5)
-
-    def findPose(self, img):
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.pose.process(imgRGB)
-        if self.results.pose_landmarks:
+        # Optional PoseInferenceService; when set, MediaPipe runs in its worker processes
+        self.service = service
+        # Optional PoseScheduler that picks model complexity and skips frames to meet a latency target
+        self.scheduler = scheduler
+        self.complexity = scheduler.complexity if scheduler else 1
+        self.poses = {}
+        self.pose = self.createPose(self.complexity)
+        self.landmarks = None
+        # Landmarks as one preallocated float32 array (x, y in pixels, z, visibility);
+        # lmPixels is a view of its x, y columns
+        self.lmArray = new_landmark_array()
+        self.lmPixels = self.lmArray[:, :2]
+        # Drawing specs are built once and reused for every rendered frame
+        self.landmarkSpec = self.mpDraw.DrawingSpec(color=(0, 0, 0), thickness=1, circle_radius=1)
+        self.connectionSpec = self.mpDraw.DrawingSpec(color=(255, 255, 255), thickness=2)
+
+        # Region-of-interest tracking: crop to a padded box around the last pose
+        # and run inference on that crop, downscaled to at most inference_width
+        self.roi_tracking = roi_tracking
+        self.roi_padding = roi_padding
+        self.inference_width = inference_width
+        self.roi = None  # (x1, y1, x2, y2) in pixels; None means full frame
+
+    def createPose(self, complexity):
+        # One warm Pose instance per complexity so switching doesn't reload the model
+        if self.service:
+            return None
+        if complexity not in self.poses:
+            self.poses[complexity] = self.mpPose.Pose(static_image_mode=False, model_complexity=complexity, 
+                                                      smooth_landmarks=True, min_detection_confidence=0.5, 
+                                                      min_tracking_confidence=0.5)
+        return self.poses[complexity]
+
+    def detect(self, img, schedule=True):
+        # Inference only; nothing is drawn on img. schedule=False always runs the model
+        # on img (one-shot captures) and leaves the streaming scheduler untouched
+        scheduled = self.scheduler is not None and schedule
+        if scheduled:
+            if self.landmarks and not self.scheduler.should_infer():
+                self.landmarks = self.scheduler.predict(self.landmarks)
+                return self.landmarks
+            if self.scheduler.complexity != self.complexity:
+                self.complexity = self.scheduler.complexity
+                self.pose = self.createPose(self.complexity)
+            start = time.time()
+
+        landmarks = self._process(img, self.roi) if self.roi else None
+        if landmarks is None:
+            # Tracking lost (or not enabled): run on the full frame
+            self.roi = None
+            landmarks = self._process(img, None)
+        if self.roi_tracking:
+            self._updateRoi(landmarks, img.shape[1], img.shape[0])
+
+        if scheduled:
+            self.scheduler.record(time.time() - start, landmarks)
+        self.landmarks = landmarks
+        return landmarks
+
+    def _process(self, img, roi):
+        h, w, _ = img.shape
+        x1, y1, x2, y2 = roi or (0, 0, w, h)
+        crop = img[y1:y2, x1:x2]
+        ch, cw = y2 - y1, x2 - x1
+        if self.inference_width and cw > self.inference_width:
+            size = (self.inference_width, int(ch * self.inference_width / cw))
+            crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        imgRGB = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        if self.service:
+            points = self.service.infer(imgRGB, key=id(self), complexity=self.complexity)
+            landmarks = to_landmark_list(points) if points is not None else None
+        else:
+            self.results = self.pose.process(imgRGB)
+            landmarks = self.results.pose_landmarks
+        if landmarks and roi:
+            # Map crop-normalized coordinates back to the full frame
+            for lm in landmarks.landmark:
+                lm.x = (x1 + lm.x * cw) / w
+                lm.y = (y1 + lm.y * ch) / h
+                lm.z = lm.z * cw / w
+        return landmarks
+
+    def _updateRoi(self, landmarks, w, h):
+        if not landmarks:
+            self.roi = None
+            return
+        points = [(lm.x * w, lm.y * h) for lm in landmarks.landmark if lm.visibility > 0.5]
+        if len(points) < 4:
+            points = [(lm.x * w, lm.y * h) for lm in landmarks.landmark]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        bx1, by1, bx2, by2 = min(xs), min(ys), max(xs), max(ys)
+        pad = self.roi_padding * max(bx2 - bx1, by2 - by1)
+
+        # Keep the current box while the pose stays well inside it, so the crop
+        # (and MediaPipe's temporal smoothing) is stable for a fixed camera
+        if self.roi:
+            x1, y1, x2, y2 = self.roi
+            margin = pad / 2
+            if bx1 - margin >= x1 and by1 - margin >= y1 and bx2 + margin <= x2 and by2 + margin <= y2:
+                return
+
+        self.roi = (max(0, int(bx1 - pad)), max(0, int(by1 - pad)),
+                    min(w, int(bx2 + pad)), min(h, int(by2 + pad)))
+        if self.roi[2] - self.roi[0] < 32 or self.roi[3] - self.roi[1] < 32:
+            self.roi = None
+
+    def drawPose(self, img, landmarks):
+        if landmarks:
             self.mpDraw.draw_landmarks(
-                img, self.results.pose_landmarks, self.mpPose.POSE_CONNECTIONS,
-                landmark_drawing_spec=self.mpDraw.DrawingSpec(color=(0, 0, 0), thickness=1, circle_radius=1),
-                connection_drawing_spec=self.mpDraw.DrawingSpec(color=(255, 255, 255), thickness=2)
+                img, landmarks, self.mpPose.POSE_CONNECTIONS,
+                landmark_drawing_spec=self.landmarkSpec,
+                connection_drawing_spec=self.connectionSpec
             )
-            for landmark in self.results.pose_landmarks.landmark:
-                h, w, _ = img.shape
+            h, w, _ = img.shape
+            for landmark in landmarks.landmark:
                 cx, cy = int(landmark.x * w), int(landmark.y * h)
                 cv2.circle(img, (cx, cy), 10, (0, 0, 255), 2)  # Red outer circle
                 cv2.circle(img, (cx, cy), 5, (0, 255, 0), cv2.FILLED)  # Green inner circle
         return img
 
+    def findPose(self, img, draw=True):
+        landmarks = self.detect(img)
+        if draw:
+            self.drawPose(img, landmarks)
+        return img
+
     def findPosition(self, img):
-        self.lmList = []
-        if self.results.pose_landmarks:
-            for id, lm in enumerate(self.results.pose_landmarks.landmark):
-                h, w, _ = img.shape
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                self.lmList.append([id, cx, cy])
-        return self.lmList
+        # Fills the reused 33x4 landmark array in place; callers that keep it across frames must copy
+        if not self.landmarks:
+            return None
+        h, w, _ = img.shape
+        return fill_landmark_array(self.landmarks, self.lmArray, w, h)
 
     def findAngle(self, img, p1, p2, p3, draw=True):
-        if len(self.lmList) < max(p1, p2, p3):
+        if not self.landmarks:
             return 0
 
-        coords = [(self.lmList[p][1], self.lmList[p][2]) for p in [p1, p2, p3]]
+        coords = [(int(self.lmPixels[p][0]), int(self.lmPixels[p][1])) for p in [p1, p2, p3]]
         x1, y1 = coords[0]
         x2, y2 = coords[1]
         x3, y3 = coords[2]
@@ -72,77 +198,232 @@ class PoseDetector:
                         cv2.FONT_HERSHEY_PLAIN, 2, (0, 0, 255), 2)
         return angle
 
-def get_joint_angles(detector, img):
-    lmDict = detector.findPosition(img)
-    if not lmDict:
+# One batched angle engine for the full set, plus one per exercise for only the triples it reads
+ALL_ANGLES = AngleEngine()
+EXERCISE_ANGLES = {
+    'Squats': AngleEngine(squat.JOINT_ANGLES),
+    'Pushups': AngleEngine(pushup.JOINT_ANGLES),
+    'Plank': AngleEngine(plank.JOINT_ANGLES)
+}
+
+def get_joint_angles(detector, img, engine=ALL_ANGLES):
+    points = detector.findPosition(img)
+    if points is None:
         raise ValueError("No pose detected")
-    return {
-        'left_shoulder_angle': detector.findAngle(img, 13, 11, 23, draw=False),
-        'right_shoulder_angle': detector.findAngle(img, 14, 12, 24, draw=False),
-        'left_hip_angle_squat': detector.findAngle(img, 11, 23, 25, draw=False),
-        'right_hip_angle_squat': detector.findAngle(img, 12, 24, 26, draw=False),
-        'left_knee_angle': detector.findAngle(img, 23, 25, 27, draw=False),
-        'right_knee_angle': detector.findAngle(img, 24, 26, 28, draw=False),
-        'left_ankle_angle': detector.findAngle(img, 25, 27, 31, draw=False),
-        'right_ankle_angle': detector.findAngle(img, 26, 28, 32, draw=False),
-        'back_angle': detector.findAngle(img, 7, 11, 23, draw=False),  # Using left side for back angle
-        'left_elbow_angle': detector.findAngle(img, 11, 13, 15, draw=False),
-        'right_elbow_angle': detector.findAngle(img, 12, 14, 16, draw=False),
-        'left_hand_to_shoulder_angle': detector.findAngle(img, 15, 13, 11, draw=False),
-        'right_hand_to_shoulder_angle': detector.findAngle(img, 16, 14, 12, draw=False),
-        # Hip angles for pushups
-        'left_hip_angle_pushup': detector.findAngle(img, 11, 23, 27, draw=False),
-        'right_hip_angle_pushup': detector.findAngle(img, 12, 24, 28, draw=False)
-    }
-
-
-def analyze_current_exercise(detector, img):
-    global current_exercise
-    try:
-        joint_angles = get_joint_angles(detector, img)
-        if current_exercise == 'Squats':
-            feedback, debug_info, per, bar = analyze_squat(joint_angles)
-        elif current_exercise == 'Pushups':
-            feedback, debug_info, per, bar = analyze_pushup(joint_angles)
-        elif current_exercise == 'Plank':
-            feedback, debug_info, per, bar = analyze_plank(joint_angles)
-        else:
-            feedback, debug_info, per, bar = "Select an exercise.", "", 0, 0
+    return engine.angles(points)
+
+
+class TrainingSession:
+    """One trainee: owns its capture source, pose detector, exercise analyzers and video stream."""
 
-        if feedback:
-            print(f"Exercise Feedback: {feedback}")
-        return feedback, debug_info, per, bar
-    except ValueError:
-        return "No pose detected.", "", 0, 0
+    def __init__(self, session_id, source=0, exercise='Squats'):
+        self.session_id = session_id
+        self.source = source
+        self.exercise = exercise
+        self.cap = None
+        self.detector = None
+        self.analyzers = {
+            'Squats': SquatAnalyzer(),
+            'Pushups': PushupAnalyzer(),
+            'Plank': PlankAnalyzer()
+        }
+        # Each frame is encoded once into a complete multipart chunk and shared by all viewers
+        self.encoder = JpegEncoder(quality=80, max_width=960, max_fps=30)
+        # Single capture+inference loop shared by every /video_feed client of this session
+        self.broadcaster = FrameBroadcaster(self.create_pipeline, on_item=self.send_coach_prompt,
+                                            on_backpressure=self.encoder.adapt)
+        self.last_request_time = time.time()
+        self.last_active = time.time()
+        self.lock = threading.Lock()
+
+    def initialize_capture(self):
+        with self.lock:
+            if self.cap is None:
+                self.cap = cv2.VideoCapture(self.source)
+            if self.detector is None:
+                self.detector = PoseDetector(roi_tracking=True, inference_width=480, scheduler=PoseScheduler(),
+                                             service=get_service(POSE_WORKERS))
+
+    def analyze(self, img):
+        try:
+            joint_angles = get_joint_angles(self.detector, img, EXERCISE_ANGLES.get(self.exercise, ALL_ANGLES))
+            analyzer = self.analyzers.get(self.exercise)
+            if analyzer is None:
+                feedback, debug_info, per, bar = "Select an exercise.", "", 0, 0
+            elif self.exercise == 'Plank':
+                feedback, debug_info, per, bar = analyzer.analyze(joint_angles), "", 0, 0
+            else:
+                feedback, debug_info, per, bar = analyzer.analyze(joint_angles)
 
-# Global variables for video capture and pose detector
-cap = None
-detector = None
+            if feedback:
+                print(f"[{self.session_id}] Exercise Feedback: {feedback}")
+            return feedback, debug_info, per, bar
+        except ValueError:
+            return "No pose detected.", "", 0, 0
 
-def initialize_capture():
-    global cap, detector
-    if cap is None:
-        cap = cv2.VideoCapture(0)
-    if detector is None:
-        detector = PoseDetector()
+    def process_frame(self, img):
+        landmarks = self.detector.detect(img)
+        feedback, debug_info, per, bar = self.analyze(img)
+        # The detector reuses its landmark array, so keep a copy with this frame's result
+        points = self.detector.lmArray.copy() if landmarks else None
+        return img, {"feedback": feedback, "debug_info": debug_info, "per": per, "bar": bar,
+                     "landmarks": landmarks, "points": points}
+
+    def encode_frame(self, img, result):
+        # The overlay is drawn only for frames the encoder actually sends
+        return self.encoder.encode(img, overlay=lambda frame: self.detector.drawPose(frame, result["landmarks"]))
+
+    def send_coach_prompt(self, item):
+        chunk, result = item
+        feedback = result["feedback"]
+        self.last_active = time.time()
+
+        # Queue a coach prompt every 40 seconds; delivery happens off the frame loop
+        current_time = time.time()
+        if current_time - self.last_request_time >= 40:
+            prompt = f"The current exercise is: {self.exercise} The feedback for {self.exercise} is: {feedback}. Take this and give helpful feedback but keep it breif."
+            payload = {"prompt": prompt, "exercise": self.exercise}
+            # Keyed by session so a prompt still waiting is replaced by the fresher one
+            coach_outbox.post(COACH_URL, payload, headers={"Content-Type": "application/json"},
+                              callback=log_coach_prompt, key=self.session_id)
+            self.last_request_time = current_time
+
+    def create_pipeline(self):
+        self.initialize_capture()
+        return FramePipeline(self.cap, self.process_frame, self.encode_frame)
+
+    def capture_angles(self):
+        self.last_active = time.time()
+        if self.broadcaster.pipeline is not None:
+            # Already streaming: take the next analyzed frame rather than reading the camera twice
+            subscriber = self.broadcaster.subscribe()
+            try:
+                for chunk, result in subscriber:
+                    if result["points"] is None:
+                        raise ValueError("No pose detected")
+                    return ALL_ANGLES.angles(result["points"])
+                raise RuntimeError("Failed to capture video frame")
+            finally:
+                subscriber.close()
+
+        self.initialize_capture()
+        with self.lock:
+            success, img = self.cap.read()
+            if not success:
+                raise RuntimeError("Failed to capture video frame")
+            self.detector.detect(img, schedule=False)  # Angles only, from this exact frame
+            return get_joint_angles(self.detector, img)
+
+    def generate_frames(self, view_mode):
+        subscriber = self.broadcaster.subscribe(video_only=True)
+        try:
+            for chunk, result in subscriber:
+                yield chunk
+        finally:
+            subscriber.close()
+
+    def close(self):
+        with self.broadcaster.lock:
+            subscribers = list(self.broadcaster.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        with self.lock:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+
+
+class SessionManager:
+    """Creates, looks up and reaps TrainingSessions.
+
+    Every session runs its own capture/inference/encode threads, so sessions
+    progress in parallel; max_sessions bounds how many run on this box at once.
+    """
+
+    def __init__(self, max_sessions=8, idle_timeout=600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id, source=0, create=True):
+        self.reap_idle()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None and create:
+                if len(self.sessions) >= self.max_sessions:
+                    raise RuntimeError(f"Session limit reached ({self.max_sessions})")
+                session = self.sessions[session_id] = TrainingSession(session_id, source)
+            return session
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session:
+            session.close()
+        return session is not None
+
+    def reap_idle(self):
+        now = time.time()
+        with self.lock:
+            idle = [sid for sid, session in self.sessions.items()
+                    if not session.broadcaster.subscribers and now - session.last_active > self.idle_timeout]
+            sessions = [self.sessions.pop(sid) for sid in idle]
+        for session in sessions:
+            session.close()
+
+
+sessions = SessionManager()
+
+def get_session_id():
+    data = request.get_json(silent=True) or {}
+    return request.args.get('session') or data.get('session_id') or DEFAULT_SESSION
+
+def resolve_source(source):
+    # Clients pick a configured source; they never hand arbitrary paths or URLs to OpenCV
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    if isinstance(source, bool) or source not in ALLOWED_SOURCES:
+        return None
+    return source
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id') or uuid.uuid4().hex[:8]
+    source = resolve_source(data.get('source', ALLOWED_SOURCES[0] if ALLOWED_SOURCES else 0))
+    if source is None:
+        return jsonify({"error": "Capture source not allowed", "allowed_sources": ALLOWED_SOURCES}), 400
+    try:
+        session = sessions.get(session_id, source=source)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    if data.get('exercise'):
+        session.exercise = data['exercise']
+    return jsonify({"session_id": session.session_id, "current_exercise": session.exercise}), 200
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.remove(session_id):
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"message": "Session closed", "session_id": session_id}), 200
 
 @app.route('/start_capture', methods=['POST'])
 def start_capture():
-    global current_exercise, cap, detector
     try:
-        initialize_capture()
+        session = sessions.get(get_session_id())
         
         data = request.json
         user_query = data.get('user_query', '')
 
         # Capture a frame from the video feed
-        success, img = cap.read()
-        if not success:
-            return jsonify({"error": "Failed to capture video frame"}), 500
+        try:
+            joint_angles = session.capture_angles()
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 500
 
-        img = detector.findPose(img)
         payload = {
-            "joint_angles": get_joint_angles(detector, img),
+            "joint_angles": joint_angles,
             "user_query": user_query
         }
         
@@ -157,53 +438,22 @@ def start_capture():
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-def generate_frames(view_mode):
-    global cap, detector
-    initialize_capture()
-    
-    last_request_time = time.time()
-    
-    while True:
-        success, img = cap.read()
-        if not success:
-            break
-        img = detector.findPose(img)
-        feedback, debug_info, per, bar = analyze_current_exercise(detector, img)
-
-        # Send POST request every 50 seconds
-        current_time = time.time()
-        if current_time - last_request_time >= 40:
-            prompt = f"The current exercise is: {current_exercise} The feedback for {current_exercise} is: {feedback}. Take this and give helpful feedback but keep it breif."
-            payload = {"prompt": prompt, "exercise": current_exercise}
-            try:
-                response = requests.post('http://localhost:8080/prompt', 
-                                         headers={"Content-Type": "application/json"}, 
-                                         json=payload, 
-                                         timeout=5)  # 5 seconds timeout
-                response.raise_for_status()
-                print(f"Sent POST request to 8080/prompt: {payload}")
-            except requests.RequestException as e:
-                print(f"Failed to send POST request: {str(e)}")
-            
-            last_request_time = current_time
-
-        ret, buffer = cv2.imencode('.jpg', img)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
 @app.route('/video_feed/<view_mode>')
 def video_feed(view_mode):
     if view_mode not in ['split', 'video', 'webcam']:
         view_mode = 'split'  # Default to 'split' if invalid view_mode is provided
-    return Response(generate_frames(view_mode), mimetype='multipart/x-mixed-replace; boundary=frame')
+    try:
+        session = sessions.get(get_session_id())
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return Response(session.generate_frames(view_mode), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/current_exercise', methods=['POST'])
 def current_exercise_route():
-    global current_exercise
-    current_exercise = request.json.get('exercise', 'Squats')
-    print(f"Exercise changed to: {current_exercise}")  # Console log the exercise change
-    return jsonify({"message": "Exercise updated", "current_exercise": current_exercise}), 200
+    session = sessions.get(get_session_id())
+    session.exercise = request.json.get('exercise', 'Squats')
+    print(f"[{session.session_id}] Exercise changed to: {session.exercise}")  # Console log the exercise change
+    return jsonify({"message": "Exercise updated", "current_exercise": session.exercise}), 200
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=SERVER_PORT, debug=True)
\ No newline at end of file
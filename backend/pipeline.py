@@ -0,0 +1,263 @@
+import threading
+import queue
+import time
+import cv2
+from bounded_queue import DropOldestQueue
+
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+class JpegEncoder:
+    """Encodes frames into ready-to-send MJPEG parts with quality, size and rate caps.
+
+    When `adapt(lagging=True)` is reported (clients dropping frames), quality is
+    lowered first and then the frame is downscaled; after `recover_after` healthy
+    frames it steps back up towards the configured settings.
+    """
+
+    def __init__(self, quality=80, max_width=None, max_fps=None,
+                 min_quality=40, min_scale=0.5, recover_after=30):
+        self.max_quality = quality
+        self.min_quality = min_quality
+        self.max_width = max_width
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self.min_scale = min_scale
+        self.recover_after = recover_after
+        self.quality = quality
+        self.scale = 1.0
+        self.healthy = 0
+        self.last_encode = 0
+
+    def encode(self, img, overlay=None):
+        now = time.time()
+        if now - self.last_encode < self.min_interval:
+            return None
+        self.last_encode = now
+        if overlay:
+            img = overlay(img)
+
+        h, w = img.shape[:2]
+        scale = self.scale
+        if self.max_width and w * scale > self.max_width:
+            scale = self.max_width / w
+        if scale < 1.0:
+            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+        ret, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ret:
+            return None
+        # bytes.join reads the encoded array through the buffer protocol, so the
+        # JPEG data is copied exactly once into the final multipart chunk
+        return b''.join((MJPEG_PART_HEADER, buffer, b'\r\n'))
+
+    def adapt(self, lagging):
+        if lagging:
+            self.healthy = 0
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 10)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale - 0.125)
+            return
+        self.healthy += 1
+        if self.healthy >= self.recover_after:
+            self.healthy = 0
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + 0.125)
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + 10)
+
+
+class FramePipeline:
+    """Capture -> inference -> encode, each stage on its own thread.
+
+    Stages are joined by DropOldestQueues, so throughput follows the slowest
+    stage and a slow stage skips stale frames instead of building a backlog.
+    `process(img)` returns (img, result); `encode(img, result)` returns the bytes to
+    stream, or None to skip the video frame. Every analyzed frame is yielded as
+    (chunk, result), with chunk None when it was not encoded, so encode limits
+    never hide analysis results.
+    """
+
+    def __init__(self, cap, process, encode, maxsize=2):
+        self.cap = cap
+        self.process = process
+        self.encode = encode
+        self.frames = DropOldestQueue(maxsize)  # capture -> inference
+        self.results = DropOldestQueue(maxsize)  # inference -> encoder
+        self.output = DropOldestQueue(maxsize)  # encoder -> consumer
+        self.running = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.running.set()
+        self.threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._stage_loop, args=(self.frames, self.process, self.results), daemon=True),
+            threading.Thread(target=self._stage_loop, args=(self.results, self._encode, self.output), daemon=True)
+        ]
+        for t in self.threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        for q in (self.frames, self.results, self.output):
+            q.close()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout=1.0)
+
+    def _capture_loop(self):
+        while self.running.is_set():
+            success, img = self.cap.read()
+            if not success:
+                break
+            self.frames.put(img)
+        # Let downstream stages drain what they already have, then finish
+        self.frames.close()
+
+    def _encode(self, item):
+        img, result = item
+        return self.encode(img, result), result
+
+    def _stage_loop(self, src, fn, dst):
+        while self.running.is_set():
+            try:
+                item = src.get(timeout=0.5)
+            except queue.Empty:
+                if src.closed:
+                    break
+                continue
+            try:
+                out = fn(item)
+                if out is not None:
+                    dst.put(out)
+            except Exception as e:
+                print(f"Pipeline stage error: {e}")
+        dst.close()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.output.get(timeout=0.5)
+            except queue.Empty:
+                if self.output.closed:
+                    return
+
+
+class Subscriber:
+    """One consumer of a FrameBroadcaster with its own buffer and backpressure policy.
+
+    'drop_oldest' keeps the newest `maxsize` items (live viewers), 'drop_newest'
+    keeps what is already queued and skips new items until the consumer catches up.
+    With `video_only=True` items without an encoded chunk are never queued, so
+    viewers only see frames they can stream.
+    """
+
+    POLICIES = ('drop_oldest', 'drop_newest')
+
+    def __init__(self, broadcaster, maxsize=1, policy='drop_oldest', video_only=False):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.broadcaster = broadcaster
+        self.policy = policy
+        self.video_only = video_only
+        self.queue = DropOldestQueue(maxsize)
+
+    def offer(self, item):
+        if self.video_only and not item[0]:
+            return
+        if self.policy == 'drop_newest' and len(self.queue.items) == self.queue.items.maxlen:
+            self.queue.dropped += 1
+            return
+        self.queue.put(item)
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.queue.closed:
+                    return
+
+
+class FrameBroadcaster:
+    """Runs a single FramePipeline and fans its output out to any number of subscribers.
+
+    The pipeline is created by `pipeline_factory` when the first subscriber joins and
+    stopped when the last one leaves, so capture and inference run once regardless of
+    how many clients are watching. `on_item` is called once per produced item, on the
+    publisher thread, for work that must not be repeated per subscriber.
+    `on_backpressure(lagging)` is told after each item whether any subscriber had
+    to drop frames, which lets the encoder adapt to the slowest client.
+    With `keep_alive=True` the pipeline can be started with `start()` and keeps
+    running with no subscribers, without a placeholder consumer skewing backpressure.
+    """
+
+    def __init__(self, pipeline_factory, on_item=None, on_backpressure=None, keep_alive=False):
+        self.pipeline_factory = pipeline_factory
+        self.keep_alive = keep_alive
+        self.on_item = on_item
+        self.on_backpressure = on_backpressure
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.pipeline = None
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            self._ensure_pipeline()
+
+    def subscribe(self, maxsize=1, policy='drop_oldest', video_only=False):
+        sub = Subscriber(self, maxsize, policy, video_only)
+        with self.lock:
+            self.subscribers.append(sub)
+            self._ensure_pipeline()
+        return sub
+
+    def _ensure_pipeline(self):
+        # Caller holds self.lock
+        if self.pipeline is None:
+            self.pipeline = self.pipeline_factory().start()
+            self.thread = threading.Thread(target=self._publish_loop, args=(self.pipeline,), daemon=True)
+            self.thread.start()
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+            sub.queue.close()
+            pipeline = None
+            if not self.subscribers and not self.keep_alive and self.pipeline is not None:
+                pipeline, self.pipeline = self.pipeline, None
+        if pipeline is not None:
+            pipeline.stop()
+
+    def _publish_loop(self, pipeline):
+        for item in pipeline:
+            if self.on_item:
+                try:
+                    self.on_item(item)
+                except Exception as e:
+                    print(f"Broadcaster callback error: {e}")
+            with self.lock:
+                subscribers = list(self.subscribers)
+            lagging = False
+            for sub in subscribers:
+                dropped = sub.queue.dropped
+                sub.offer(item)
+                lagging = lagging or sub.queue.dropped > dropped
+            if self.on_backpressure:
+                self.on_backpressure(lagging)
+        # Source ended (camera closed or pipeline stopped); release anyone still attached
+        with self.lock:
+            if self.pipeline is not pipeline:
+                return
+            subscribers, self.subscribers = self.subscribers, []
+            self.pipeline = None
+        for sub in subscribers:
+            sub.queue.close()
+        pipeline.stop()
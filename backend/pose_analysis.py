@@ -7,6 +7,13 @@ import time
 import numpy as np
 import requests
 import json
+from pose_scheduler import PoseScheduler
+from joint_angles import new_landmark_array, fill_landmark_array
+from landmark_stats import LandmarkAggregator
+from pipeline import FramePipeline, FrameBroadcaster, JpegEncoder
+from inference_pool import get_service, to_landmark_list
+import os
+import threading
 
 app = Flask(__name__)
 CORS(app)
@@ -14,66 +21,199 @@ CORS(app)
 class PoseDetector:
     def __init__(self, mode=False, complexity=1, smooth_landmarks=True,
                  enable_segmentation=False, smooth_segmentation=True,
-                 detectionCon=0.5, trackCon=0.5):
+                 detectionCon=0.5, trackCon=0.5, scheduler=None, service=None):
         
         self.mode = mode 
-        self.complexity = complexity
+        self.complexity = scheduler.complexity if scheduler else complexity
         self.smooth_landmarks = smooth_landmarks
         self.enable_segmentation = enable_segmentation
         self.smooth_segmentation = smooth_segmentation
         self.detectionCon = detectionCon
         self.trackCon = trackCon
+        # Optional PoseScheduler that picks model complexity and skips frames to meet a latency target
+        self.scheduler = scheduler
+        # Optional PoseInferenceService; when set, MediaPipe runs in its worker processes
+        self.service = service
         
         self.mpDraw = mp.solutions.drawing_utils
         self.mpPose = mp.solutions.pose
-        self.pose = self.mpPose.Pose(self.mode, self.complexity, self.smooth_landmarks,
-                                     self.enable_segmentation, self.smooth_segmentation,
-                                     self.detectionCon, self.trackCon)
+        self.poses = {}
+        self.pose = self.createPose(self.complexity)
+        self.landmarks = None
+        # Landmarks as one preallocated float32 array (x, y in pixels, z, visibility);
+        # lmPixels is a view of its x, y columns
+        self.lmArray = new_landmark_array()
+        self.lmPixels = self.lmArray[:, :2]
+
+    def createPose(self, complexity):
+        # One warm Pose instance per complexity so switching doesn't reload the model
+        if self.service:
+            return None
+        if complexity not in self.poses:
+            self.poses[complexity] = self.mpPose.Pose(self.mode, complexity, self.smooth_landmarks,
+                                                      self.enable_segmentation, self.smooth_segmentation,
+                                                      self.detectionCon, self.trackCon)
+        return self.poses[complexity]
         
     def findPose(self, img, draw=True):
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.pose.process(imgRGB)
+        if self.scheduler and self.landmarks and not self.scheduler.should_infer():
+            self.landmarks = self.scheduler.predict(self.landmarks)
+        else:
+            if self.scheduler and self.scheduler.complexity != self.complexity:
+                self.complexity = self.scheduler.complexity
+                self.pose = self.createPose(self.complexity)
+            start = time.time()
+            imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if self.service:
+                points = self.service.infer(imgRGB, key=id(self), complexity=self.complexity)
+                self.landmarks = to_landmark_list(points) if points is not None else None
+            else:
+                self.results = self.pose.process(imgRGB)
+                self.landmarks = self.results.pose_landmarks
+            if self.scheduler:
+                self.scheduler.record(time.time() - start, self.landmarks)
         
-        if self.results.pose_landmarks:
+        if self.landmarks:
             if draw:
-                self.mpDraw.draw_landmarks(img, self.results.pose_landmarks,
+                self.mpDraw.draw_landmarks(img, self.landmarks,
                                            self.mpPose.POSE_CONNECTIONS)
                 
         return img
     
     def findPosition(self, img, draw=True):
-        self.lmList = []
-        if self.results.pose_landmarks:
-            for id, lm in enumerate(self.results.pose_landmarks.landmark):
-                h, w, c = img.shape
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                self.lmList.append([id, cx, cy])
-                if draw:
-                    cv2.circle(img, (cx, cy), 5, (255,0,0), cv2.FILLED)
-        return self.lmList
-
-# Global storage for captured data
-landmark_storage = []
+        # Fills the reused 33x4 landmark array in place; callers that keep it across frames must copy
+        if not self.landmarks:
+            return None
+        h, w, c = img.shape
+        fill_landmark_array(self.landmarks, self.lmArray, w, h)
+        if draw:
+            for cx, cy in self.lmPixels.astype(int).tolist():
+                cv2.circle(img, (cx, cy), 5, (255,0,0), cv2.FILLED)
+        return self.lmArray
+
+# Out-of-process pose inference shared by every detector; POSE_WORKERS=0 keeps MediaPipe in-process
+POSE_WORKERS = int(os.getenv('POSE_WORKERS', '0'))
+
 user_query = ""
 
+class CaptureService:
+    """Long-lived camera + detector shared by /start_capture and /video_feed.
+
+    The camera and model are opened once and kept warm by a keep-alive broadcaster,
+    so a capture request attaches to the running stream and starts collecting
+    frames immediately. If frames stop arriving for `stale_after` seconds the
+    stream is torn down and reopened on the next request.
+    """
+
+    def __init__(self, source=0, stale_after=2.0):
+        self.source = source
+        self.stale_after = stale_after
+        self.cap = None
+        self.detector = None
+        self.encoder = JpegEncoder(quality=80, max_fps=30)
+        self.broadcaster = FrameBroadcaster(self.create_pipeline, on_item=self.on_item,
+                                            on_backpressure=self.encoder.adapt, keep_alive=True)
+        self.viewers = 0
+        self.frames = 0
+        self.started_at = None
+        self.last_frame_time = None
+        self.first_frame = threading.Event()
+        self.lock = threading.Lock()
+
+    def create_pipeline(self):
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(self.source)
+        if self.detector is None:
+            # No frame skipping: captured frames must all be real detections
+            self.detector = PoseDetector(scheduler=PoseScheduler(max_skip=0), service=get_service(POSE_WORKERS))
+        return FramePipeline(self.cap, self.process_frame, self.encode_frame)
+
+    def process_frame(self, img):
+        self.detector.findPose(img, draw=False)
+        points = self.detector.findPosition(img, draw=False)
+        return img, {"points": points.copy() if points is not None else None,
+                     "landmarks": self.detector.landmarks}
+
+    def encode_frame(self, img, result):
+        # Only pay for JPEG encoding while someone is watching /video_feed
+        if not self.viewers:
+            return b''
+        return self.encoder.encode(img, overlay=lambda frame: self.drawLandmarks(frame, result["landmarks"]))
+
+    def drawLandmarks(self, img, landmarks):
+        if landmarks:
+            self.detector.mpDraw.draw_landmarks(img, landmarks, self.detector.mpPose.POSE_CONNECTIONS)
+        return img
+
+    def on_item(self, item):
+        self.frames += 1
+        self.last_frame_time = time.time()
+        self.first_frame.set()
+
+    def start(self, warmup_timeout=10.0):
+        with self.lock:
+            if self.broadcaster.pipeline is None:
+                self.first_frame.clear()
+                self.started_at = time.time()
+                self.broadcaster.start()
+        # Warm-up: wait until the camera and model have produced a first frame
+        return self.first_frame.wait(warmup_timeout)
+
+    def restart(self):
+        with self.lock:
+            pipeline = self.broadcaster.pipeline
+            if pipeline is not None:
+                pipeline.stop()
+                self.broadcaster.thread.join(timeout=2.0)
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+        return self.start()
+
+    def ensure_running(self, warmup_timeout=10.0):
+        if self.healthy():
+            return True
+        if self.broadcaster.pipeline is not None and not self.first_frame.is_set():
+            # Still warming up
+            return self.first_frame.wait(warmup_timeout)
+        return self.restart()
+
+    def healthy(self):
+        return (self.broadcaster.pipeline is not None and self.last_frame_time is not None
+                and time.time() - self.last_frame_time < self.stale_after)
+
+    def health(self):
+        return {
+            "running": self.broadcaster.pipeline is not None,
+            "healthy": self.healthy(),
+            "frames": self.frames,
+            "viewers": self.viewers,
+            "last_frame_age": time.time() - self.last_frame_time if self.last_frame_time else None,
+            "uptime": time.time() - self.started_at if self.started_at else None
+        }
+
+
+capture_service = CaptureService()
+
 def capture_landmarks_for_duration(duration=3):
-    global landmark_storage
-    landmark_storage = []  # Reset storage
-    
-    detector = PoseDetector()
-    cap = cv2.VideoCapture(0)
-    
-    start_time = time.time()
-    while time.time() - start_time < duration:
-        ret, img = cap.read()
-        if not ret:
-            break
-        img = detector.findPose(img)
-        lmList = detector.findPosition(img, draw=False)
-        if lmList:
-            landmark_storage.append(lmList)  # Collect the landmarks
-
-    cap.release()
+    # Running statistics for this capture only; constant memory however long it runs,
+    # and overlapping requests never share or reset each other's window
+    landmark_stats = LandmarkAggregator()
+    if not capture_service.ensure_running():
+        return landmark_stats
+
+    # Attach to the running stream; keep a few frames of slack so none are skipped
+    subscriber = capture_service.broadcaster.subscribe(maxsize=8)
+    try:
+        start_time = time.time()
+        for chunk, result in subscriber:
+            # Frames with no pose are counted as missed and skipped
+            landmark_stats.add(result["points"])
+            if time.time() - start_time >= duration:
+                break
+    finally:
+        subscriber.close()
+    return landmark_stats
 
 def calculate_angle(a, b, c):
     a = np.array(a)
@@ -90,12 +230,12 @@ def calculate_angle(a, b, c):
 
 import numpy as np
 
-def process_landmarks():
-    if not landmark_storage:
+def process_landmarks(landmark_stats):
+    if landmark_stats.count == 0:
         return None
 
-    # Calculate average position for each landmark
-    avg_landmarks = np.mean(landmark_storage, axis=0)
+    # Average position for each landmark, accumulated while capturing
+    avg_landmarks = landmark_stats.mean
 
     # Define landmark indices
     NOSE = 0
@@ -105,7 +245,7 @@ def process_landmarks():
     LEFT_ANKLE, RIGHT_ANKLE = 27, 28
 
     def get_point(index):
-        return avg_landmarks[index][1:]
+        return avg_landmarks[index][:2]
 
     def calculate_angle(a, b, c):
         a, b, c = np.array(a), np.array(b), np.array(c)
@@ -157,10 +297,10 @@ def start_capture():
     user_query = data.get('user_query')
     
     # Capture landmarks for 5 seconds
-    capture_landmarks_for_duration(3)
+    landmark_stats = capture_landmarks_for_duration(3)
     
     # Process landmarks and send to analysis endpoint
-    angles = process_landmarks()
+    angles = process_landmarks(landmark_stats)
     if angles is None:
         return jsonify({"error": "No landmarks captured"}), 400
     
@@ -184,19 +324,28 @@ def video_feed():
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 def generate_frames():
-    detector = PoseDetector()
-    cap = cv2.VideoCapture(0)
-    while True: 
-        ret, img = cap.read()
-        if not ret:
-            break
-        img = detector.findPose(img)
-        ret, buffer = cv2.imencode('.jpg', img)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    capture_service.ensure_running()
+    subscriber = capture_service.broadcaster.subscribe(video_only=True)
+    with capture_service.lock:
+        capture_service.viewers += 1
+    try:
+        for chunk, result in subscriber:
+            if chunk:
+                yield chunk
+    finally:
+        with capture_service.lock:
+            capture_service.viewers -= 1
+        subscriber.close()
+
+@app.route('/health')
+def health():
+    status = capture_service.health()
+    return jsonify(status), 200 if status["healthy"] else 503
 
 
 
 if __name__ == "__main__":
+    # With the debug reloader only the serving child process should own the camera
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Thread(target=capture_service.start, daemon=True).start()
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
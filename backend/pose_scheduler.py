@@ -0,0 +1,128 @@
+import time
+import numpy as np
+
+
+class PoseScheduler:
+    """Adapts MediaPipe model complexity and frame skipping to a latency target.
+
+    The detector calls `should_infer()` before each frame and `record()` after each
+    real inference. When the smoothed latency stays above `target_latency` the
+    scheduler first drops model complexity (never below `min_complexity`, the
+    accuracy floor) and then starts skipping frames; when there is headroom it
+    steps back up. While the pose is nearly still (e.g. a plank hold) it also
+    skips up to `max_skip` frames. Skipped frames get landmarks extrapolated from
+    the last two inferences by `predict()`.
+
+    A level that had to be abandoned is not retried for `cooldown` inferences,
+    doubling on every further failure up to `max_cooldown`, so the scheduler
+    settles instead of flapping between a level that fits and one that doesn't.
+    The heavy model (complexity 2) is opt-in via `max_complexity` since MediaPipe
+    may have to download it at runtime.
+    """
+
+    def __init__(self, target_latency=0.05, min_complexity=0, max_complexity=1,
+                 complexity=1, max_skip=2, still_threshold=0.004, patience=10, smoothing=0.2,
+                 cooldown=150, max_cooldown=2400):
+        self.target_latency = target_latency
+        self.min_complexity = min_complexity
+        self.max_complexity = max_complexity
+        self.complexity = min(max(complexity, min_complexity), max_complexity)
+        self.max_skip = max_skip
+        self.still_threshold = still_threshold
+        self.patience = patience
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.latency = None
+        self.skip = 0  # Frames skipped per inference because of latency
+        self.skipped = 0
+        self.over = 0
+        self.under = 0
+        self.history = []  # Last two inferred poses as (timestamp, 33x4 array)
+        self.frames = 0  # Inferences recorded so far
+        self.entered = 0  # Frame at which the current level was entered
+        self.backoff = {}  # ('complexity' | 'skip', level) -> current cooldown in frames
+        self.blocked_until = {}  # ('complexity' | 'skip', level) -> frame when it may be retried
+
+    def should_infer(self):
+        skip = max(self.skip, self.max_skip if self.is_still() else 0)
+        if self.skipped < skip and len(self.history) == 2:
+            self.skipped += 1
+            return False
+        self.skipped = 0
+        return True
+
+    def record(self, latency, landmarks):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        if landmarks:
+            points = np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks.landmark], dtype=np.float32)
+            self.history = (self.history + [(time.time(), points)])[-2:]
+        else:
+            self.history = []
+        self.frames += 1
+        self._adjust()
+
+    def _adjust(self):
+        if self.latency > self.target_latency:
+            self.over += 1
+            self.under = 0
+        elif self.latency < 0.6 * self.target_latency:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+
+        # A level that held for a long time has proven itself; forget its failures
+        if self.frames - self.entered >= self.max_cooldown:
+            self.backoff.pop(('complexity', self.complexity), None)
+            self.backoff.pop(('skip', self.skip), None)
+
+        if self.over >= self.patience:
+            self.over = 0
+            if self.complexity > self.min_complexity:
+                self._abandon(('complexity', self.complexity))
+                self.complexity -= 1
+            elif self.skip < self.max_skip:
+                self._abandon(('skip', self.skip))
+                self.skip += 1
+        elif self.under >= self.patience:
+            self.under = 0
+            if self.skip > 0:
+                if self._allowed(('skip', self.skip - 1)):
+                    self.skip -= 1
+                    self.entered = self.frames
+            elif self.complexity < self.max_complexity:
+                if self._allowed(('complexity', self.complexity + 1)):
+                    self.complexity += 1
+                    self.entered = self.frames
+
+    def _abandon(self, level):
+        cooldown = min(self.backoff.get(level, self.cooldown // 2) * 2, self.max_cooldown)
+        self.backoff[level] = cooldown
+        self.blocked_until[level] = self.frames + cooldown
+        self.entered = self.frames
+
+    def _allowed(self, level):
+        return self.frames >= self.blocked_until.get(level, 0)
+
+    def is_still(self):
+        if len(self.history) < 2:
+            return False
+        (_, prev), (_, last) = self.history
+        return float(np.mean(np.abs(last[:, :2] - prev[:, :2]))) < self.still_threshold
+
+    def predict(self, landmarks):
+        # Linear extrapolation from the last two inferences, capped at one interval ahead
+        (t0, prev), (t1, last) = self.history
+        step = min((time.time() - t1) / (t1 - t0), 1.0) if t1 > t0 else 0.0
+        points = last + (last - prev) * step
+        predicted = type(landmarks)()
+        predicted.CopyFrom(landmarks)
+        for lm, (x, y, z, _) in zip(predicted.landmark, points.tolist()):
+            lm.x, lm.y, lm.z = x, y, z
+        return predicted
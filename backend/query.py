@@ -1,5 +1,7 @@
 from flask import Flask, request, jsonify
-import requests
+from http_outbox import HttpOutbox
+import functools
+import numpy as np
 
 app = Flask(__name__)
 
@@ -7,87 +9,124 @@ app = Flask(__name__)
 SERVER_PORT = 5005
 OUTPUT_URL = 'http://localhost:8080/prompt'
 HEADERS = {'Content-Type': 'application/json'}
-
-def analyze_squat(angles):
-    issues = []
-    
-    # Calculate average angles for bilateral joints
-    knee_angle = (angles['left_knee_angle'] + angles['right_knee_angle']) / 2
-    hip_angle = (angles['left_hip_angle'] + angles['right_hip_angle']) / 2
-    ankle_angle = (angles['left_ankle_angle'] + angles['right_ankle_angle']) / 2
-    shoulder_angle = (angles['left_shoulder_angle'] + angles['right_shoulder_angle']) / 2
-    back_angle = angles['back_angle']
-    
-    # Analyze squat depth
-    if knee_angle < 90:
-        depth = "too deep"
-    elif 90 <= knee_angle < 110:
-        depth = "proper depth"
-    elif 110 <= knee_angle < 130:
-        depth = "borderline depth"
-    else:
-        depth = "not deep enough"
-    
-    if depth != "proper depth":
-        issues.append(f"Squat {depth}")
-    
-    # Analyze back position
-    if back_angle < 150:
-        back_status = "significantly rounded"
-        issues.append("Back is significantly rounded")
-    elif 150 <= back_angle < 170:
-        back_status = "slightly rounded"
-        issues.append("Back is slightly rounded")
-    else:
-        back_status = "straight"
-    
-    # Analyze hip alignment
-    if 80 <= hip_angle <= 100:
-        hip_status = "well aligned"
-    elif 70 <= hip_angle < 80 or 100 < hip_angle <= 110:
-        hip_status = "slightly misaligned"
-        issues.append("Hips are slightly misaligned")
-    else:
-        hip_status = "significantly misaligned"
-        issues.append("Hips are significantly misaligned")
-    
-    # Analyze ankle mobility
-    if ankle_angle < 30:
-        ankle_status = "limited mobility"
-        issues.append("Limited ankle mobility")
-    elif 30 <= ankle_angle < 40:
-        ankle_status = "moderate mobility"
-    else:
-        ankle_status = "good mobility"
-    
-    # Analyze shoulder alignment
-    if 85 <= shoulder_angle <= 95:
-        shoulder_status = "well aligned"
-    elif 80 <= shoulder_angle < 85 or 95 < shoulder_angle <= 100:
-        shoulder_status = "slightly misaligned"
-        issues.append("Shoulders are slightly misaligned")
-    else:
-        shoulder_status = "significantly misaligned"
-        issues.append("Shoulders are significantly misaligned")
-    
-    # Determine overall squat quality
-    if not issues:
-        quality = "Excellent"
-    elif len(issues) == 1:
-        quality = "Good"
-    elif len(issues) == 2:
-        quality = "Fair"
-    else:
-        quality = "Poor"
-    
-    # Prepare the analysis report
-    report = f"""
+OUTPUT_TIMEOUT = 5  # Seconds per delivery attempt
+
+# Pooled, bounded, fire-and-forget delivery to OUTPUT_URL
+output_outbox = HttpOutbox(maxsize=16, timeout=OUTPUT_TIMEOUT, retries=2, name="query")
+
+# Squat rule table. Each check averages its angle keys and takes the first matching
+# band (low, high, status, issue, closed); None bounds are open-ended, `closed` says
+# which ends are inclusive, and a value matching no band gets the check's default.
+SQUAT_RULES = [
+    {
+        "name": "depth",
+        "label": "Depth",
+        "keys": ("left_knee_angle", "right_knee_angle"),
+        "bands": [
+            (None, 90, "too deep", "Squat too deep", "left"),
+            (90, 110, "proper depth", None, "left"),
+            (110, 130, "borderline depth", "Squat borderline depth", "left"),
+        ],
+        "default": ("not deep enough", "Squat not deep enough"),
+    },
+    {
+        "name": "back",
+        "label": "Back position",
+        "keys": ("back_angle",),
+        "bands": [
+            (None, 150, "significantly rounded", "Back is significantly rounded", "left"),
+            (150, 170, "slightly rounded", "Back is slightly rounded", "left"),
+        ],
+        "default": ("straight", None),
+    },
+    {
+        "name": "hip",
+        "label": "Hip alignment",
+        "keys": ("left_hip_angle", "right_hip_angle"),
+        "bands": [
+            (80, 100, "well aligned", None, "both"),
+            (70, 80, "slightly misaligned", "Hips are slightly misaligned", "left"),
+            (100, 110, "slightly misaligned", "Hips are slightly misaligned", "right"),
+        ],
+        "default": ("significantly misaligned", "Hips are significantly misaligned"),
+    },
+    {
+        "name": "ankle",
+        "label": "Ankle mobility",
+        "keys": ("left_ankle_angle", "right_ankle_angle"),
+        "bands": [
+            (None, 30, "limited mobility", "Limited ankle mobility", "left"),
+            (30, 40, "moderate mobility", None, "left"),
+        ],
+        "default": ("good mobility", None),
+    },
+    {
+        "name": "shoulder",
+        "label": "Shoulder alignment",
+        "keys": ("left_shoulder_angle", "right_shoulder_angle"),
+        "bands": [
+            (85, 95, "well aligned", None, "both"),
+            (80, 85, "slightly misaligned", "Shoulders are slightly misaligned", "left"),
+            (95, 100, "slightly misaligned", "Shoulders are slightly misaligned", "right"),
+        ],
+        "default": ("significantly misaligned", "Shoulders are significantly misaligned"),
+    },
+]
+QUALITY_BY_ISSUES = ["Excellent", "Good", "Fair"]  # Anything beyond is "Poor"
+
+
+class SquatRuleEngine:
+    """Compiles a rule table into a vectorized evaluator.
+
+    `evaluate` accepts one angle dict (scalars) or a dict of per-frame arrays and
+    returns, for every check, the index of the matching outcome per frame.
+    Reports are rendered from those indices and cached, since only a few hundred
+    distinct combinations exist.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.required = [key for rule in rules for key in rule["keys"]]
+        # Outcomes per check: the bands in order, then the default
+        self.outcomes = [[(band[2], band[3]) for band in rule["bands"]] + [rule["default"]] for rule in rules]
+        self.has_issue = [np.array([issue is not None for _, issue in outcomes]) for outcomes in self.outcomes]
+        self.render = functools.lru_cache(maxsize=1024)(self._render)
+
+    def evaluate(self, angles):
+        indices = []
+        for rule in self.rules:
+            value = sum(np.asarray(angles[key], dtype=np.float64) for key in rule["keys"]) / len(rule["keys"])
+            conditions = []
+            for low, high, _, _, closed in rule["bands"]:
+                cond = np.ones(np.shape(value), dtype=bool)
+                if low is not None:
+                    cond &= value >= low if closed in ("left", "both") else value > low
+                if high is not None:
+                    cond &= value <= high if closed in ("right", "both") else value < high
+                conditions.append(cond)
+            indices.append(np.select(conditions, np.arange(len(conditions)), default=len(conditions)))
+        return np.stack(indices, axis=-1)
+
+    def issue_counts(self, indices):
+        return sum(self.has_issue[i][indices[..., i]] for i in range(len(self.rules)))
+
+    def quality(self, indices):
+        counts = self.issue_counts(indices)
+        return np.array(QUALITY_BY_ISSUES + ["Poor"])[np.minimum(counts, len(QUALITY_BY_ISSUES))]
+
+    def _render(self, key):
+        statuses = []
+        issues = []
+        for rule, outcomes, index in zip(self.rules, self.outcomes, key):
+            status, issue = outcomes[index]
+            statuses.append(f"- {rule['label']}: {status}")
+            if issue:
+                issues.append(issue)
+        quality = QUALITY_BY_ISSUES[len(issues)] if len(issues) < len(QUALITY_BY_ISSUES) else "Poor"
+
+        report = f"""
 Squat Analysis:
-- Depth: {depth}
-- Back position: {back_status}
-- Hip alignment: {hip_status}
-- Ankle mobility: {ankle_status}
-- Shoulder alignment: {shoulder_status}
+{chr(10).join(statuses)}
 - Overall quality: {quality}
 
 Issues to address:
@@ -96,8 +135,35 @@ Issues to address:
 Recommendations:
 {"- Focus on maintaining proper form and addressing the identified issues." if issues else "- Keep up the good work and maintain consistent form."}
 """
-    
-    return report.strip()
+        return report.strip()
+
+    def report(self, angles):
+        indices = self.evaluate(angles)
+        if indices.ndim == 1:
+            return self.render(tuple(indices.tolist()))
+        return [self.render(key) for key in map(tuple, indices.tolist())]
+
+
+squat_rules = SquatRuleEngine(SQUAT_RULES)
+
+def analyze_squat(angles):
+    return squat_rules.report(angles)
+
+def analyze_squat_frames(frames):
+    # Grade a whole recorded set (list of angle dicts) in one vectorized pass
+    angles = {key: np.array([frame[key] for frame in frames], dtype=np.float64) for key in squat_rules.required}
+    indices = squat_rules.evaluate(angles)
+    quality = squat_rules.quality(indices)
+    labels, counts = np.unique(quality, return_counts=True)
+    return {
+        "frames": len(frames),
+        "quality": quality.tolist(),
+        "quality_counts": dict(zip(labels.tolist(), counts.tolist())),
+        "issue_frames": {
+            rule["name"]: int(squat_rules.has_issue[i][indices[:, i]].sum())
+            for i, rule in enumerate(squat_rules.rules)
+        }
+    }
 
 @app.route('/analyze', methods=['POST'])
 def analyze_squat_route():
@@ -134,13 +200,26 @@ def analyze_squat_route():
             'prompt': prompt,
         }
 
-        response = requests.post(OUTPUT_URL, headers=HEADERS, json=output_data)
+        # Delivery happens in the background so analysis never waits on the TTS server
+        output_outbox.post(OUTPUT_URL, output_data, headers=HEADERS)
+        return jsonify({"message": "Analysis completed and queued for output server", "data": output_data}), 202
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        if response.status_code == 200:
-            return jsonify({"message": "Analysis completed and sent to output server", "data": output_data}), 200
-        else:
-            return jsonify({"error": f"Failed to send data to the output server. Status code: {response.status_code}"}), 500
+@app.route('/outbox', methods=['GET'])
+def outbox_status():
+    return jsonify(output_outbox.stats()), 200
 
+@app.route('/analyze_set', methods=['POST'])
+def analyze_set_route():
+    try:
+        frames = request.json.get('frames', [])
+        if not frames:
+            return jsonify({"error": "No frames provided"}), 400
+        if not all(all(key in frame for key in squat_rules.required) for frame in frames):
+            return jsonify({"error": "Missing required joint angles"}), 400
+        return jsonify(analyze_squat_frames(frames)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
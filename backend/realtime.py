@@ -7,7 +7,11 @@ import base64
 import logging
 import os
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import itertools
+import hashlib
+import re
+from collections import OrderedDict, deque
 from aiohttp import web
 
 # Load environment variables
@@ -21,19 +25,220 @@ logger = logging.getLogger(__name__)
 CHANNELS = 1
 RATE = 24000
 CHUNK = 960
+JITTER_BUFFER_MS = 80  # Audio buffered before playback starts, to ride out network jitter
+RING_SECONDS = 30  # Fixed playback ring size; the receiver waits when it is full
+
+# Prompt scheduling
+PRIORITY_USER = 0
+PRIORITY_FEEDBACK = 1
+PROMPT_QUEUE_DEPTH = 8
+RESPONSE_TIMEOUT = 30  # Seconds to wait for a response before sending the next prompt
+
+# Synthesized audio cache for repeated coaching cues
+AUDIO_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_cache")
+AUDIO_CACHE_ENTRIES = 200
+AUDIO_CACHE_MAX_CLIP_SECONDS = 30
 
 # WebSocket configuration
 WS_URL = "wss://api.openai.com/v1/realtime"
 MODEL = "gpt-4o-realtime-preview-2024-10-01"
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+class AudioRingBuffer:
+    """Fixed-size int16 ring buffer between the websocket receiver and the output stream callback.
+
+    Playback waits until `prebuffer` samples are queued (the jitter buffer), then
+    drains continuously; once the end of a response is marked, whatever is left
+    plays out even if it is shorter than the jitter buffer.
+    """
+
+    def __init__(self, capacity, prebuffer):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.prebuffer = prebuffer
+        self.read_pos = 0
+        self.size = 0
+        self.playing = False
+        self.ended = False
+        self.underruns = 0
+        self.lock = threading.Lock()
+
+    def free(self):
+        with self.lock:
+            return self.capacity - self.size
+
+    def write(self, samples):
+        with self.lock:
+            n = min(len(samples), self.capacity - self.size)
+            start = (self.read_pos + self.size) % self.capacity
+            first = min(n, self.capacity - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:n - first] = samples[first:n]
+            self.size += n
+            self.ended = False
+            return n
+
+    def end(self):
+        with self.lock:
+            self.ended = True
+
+    def clear(self):
+        # Drop queued audio, e.g. when a response is cancelled
+        with self.lock:
+            self.read_pos = 0
+            self.size = 0
+            self.playing = False
+            self.ended = True
+
+    def read_into(self, out):
+        # Called from the audio thread; fills `out` and pads with silence
+        with self.lock:
+            if not self.playing:
+                if self.size < self.prebuffer and not (self.ended and self.size):
+                    out.fill(0)
+                    return
+                self.playing = True
+            n = min(len(out), self.size)
+            first = min(n, self.capacity - self.read_pos)
+            out[:first] = self.buffer[self.read_pos:self.read_pos + first]
+            out[first:n] = self.buffer[:n - first]
+            out[n:] = 0
+            self.read_pos = (self.read_pos + n) % self.capacity
+            self.size -= n
+            if self.size == 0:
+                # Drained: rebuild the jitter buffer before the next response plays
+                if not self.ended:
+                    self.underruns += 1
+                self.playing = False
+
+class AudioCache:
+    """Content-addressed LRU cache of synthesized PCM, persisted as one file per clip.
+
+    Clips are keyed by a hash of the exercise and the normalized prompt text; the
+    in-memory index keeps LRU order and the oldest files are deleted on eviction.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_entries=AUDIO_CACHE_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.index = OrderedDict()  # key -> path, least recently used first
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        files = [f for f in os.listdir(directory) if f.endswith(".pcm")]
+        for name in sorted(files, key=lambda f: os.path.getmtime(os.path.join(directory, f))):
+            self.index[name[:-4]] = os.path.join(directory, name)
+        self._evict()
+
+    @staticmethod
+    def key(text, exercise):
+        normalized = " ".join(re.sub(r"[^a-z0-9' ]+", " ", text.lower()).split())
+        return hashlib.sha256(f"{(exercise or '').lower()}|{normalized}".encode()).hexdigest()
+
+    def get(self, key):
+        path = self.index.get(key)
+        if path is None:
+            self.misses += 1
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            del self.index[key]
+            self.misses += 1
+            return None
+        self.index.move_to_end(key)
+        os.utime(path)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = os.path.join(self.directory, f"{key}.pcm")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.index[key] = path
+        self.index.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.index) > self.max_entries:
+            _, path = self.index.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+class PromptScheduler:
+    """Bounded priority queue for prompts: user questions go before periodic feedback.
+
+    A feedback prompt replaces any feedback still waiting for the same exercise,
+    and when the queue is full the oldest lowest-priority prompt is dropped.
+    """
+
+    def __init__(self, max_depth=PROMPT_QUEUE_DEPTH):
+        self.max_depth = max_depth
+        self.items = []  # (priority, seq, item)
+        self.seq = itertools.count()
+        self.available = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item, priority):
+        if priority == PRIORITY_FEEDBACK:
+            superseded = [e for e in self.items
+                          if e[0] == PRIORITY_FEEDBACK and e[2].get('exercise') == item.get('exercise')]
+            for entry in superseded:
+                self.items.remove(entry)
+            self.dropped += len(superseded)
+
+        entry = (priority, next(self.seq), item)
+        if len(self.items) >= self.max_depth:
+            victim = max(self.items + [entry], key=lambda e: (e[0], -e[1]))
+            self.dropped += 1
+            if victim is entry:
+                return False
+            self.items.remove(victim)
+        self.items.append(entry)
+        self.available.set()
+        return True
+
+    async def get(self):
+        while not self.items:
+            self.available.clear()
+            await self.available.wait()
+        entry = min(self.items)
+        self.items.remove(entry)
+        return entry[0], entry[2]
+
+    def qsize(self):
+        return len(self.items)
+
 class TextToSpeechAgent:
     def __init__(self):
         self.ws = None
-        self.audio_buffer = bytearray()
-        self.executor = ThreadPoolExecutor(max_workers=2)
-        self.prompt_queue = asyncio.Queue()
+        self.playback = AudioRingBuffer(RATE * RING_SECONDS, RATE * JITTER_BUFFER_MS // 1000)
+        self.output_stream = None
+        self.prompt_queue = PromptScheduler()
         self.current_exercise = "squats"
+        self.active_priority = None  # Priority of the response being generated, if any
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.audio_cache = AudioCache()
+        self.recording_key = None  # Cache key of the feedback response being recorded
+        self.recording = bytearray()
+        self.response_id = None  # Server id of the in-flight prompt response
+        self.cancelled = set()  # Ids of cancelled responses whose late events are ignored
+        self.pending_creates = deque()  # Kinds of response.create calls not yet acknowledged, in order
+        self.cancel_pending = False  # Cancel requested before the server assigned an id
+
+    def start_playback(self):
+        def callback(outdata, frames, time_info, status):
+            self.playback.read_into(outdata[:, 0])
+
+        self.output_stream = sd.OutputStream(samplerate=RATE, channels=CHANNELS, dtype='int16',
+                                             blocksize=CHUNK, callback=callback)
+        self.output_stream.start()
 
     async def connect(self):
         headers = {
@@ -58,20 +263,79 @@ class TextToSpeechAgent:
             logger.error(f"Error: {event['error']['message']}")
         elif event_type == "response.text.delta":
             logger.info(f"Text response: {event['delta']}")
+        elif event_type == "response.created":
+            response_id = event["response"]["id"]
+            kind = self.pending_creates.popleft() if self.pending_creates else "prompt"
+            if kind != "prompt":
+                return
+            if self.cancel_pending:
+                self.cancel_pending = False
+                self.cancelled.add(response_id)
+                await self.send_event({"type": "response.cancel", "response_id": response_id})
+            else:
+                self.response_id = response_id
+        elif event.get("response_id") in self.cancelled:
+            return  # Late audio from a cancelled response
         elif event_type == "response.audio.delta":
             audio_data = base64.b64decode(event["delta"])
-            self.audio_buffer.extend(audio_data)
+            # Only the tracked prompt response is recorded; instruction updates also speak
+            if self.recording_key and event.get("response_id") == self.response_id:
+                if len(self.recording) + len(audio_data) <= RATE * 2 * AUDIO_CACHE_MAX_CLIP_SECONDS:
+                    self.recording.extend(audio_data)
+                else:
+                    self.recording_key = None  # Too long to be a cue worth caching
+            await self.enqueue_audio(np.frombuffer(audio_data, dtype=np.int16))
         elif event_type == "response.audio.done":
-            audio_data = bytes(self.audio_buffer)
-            self.audio_buffer.clear()
-            await self.play_audio_async(audio_data)
-
-    async def play_audio_async(self, audio_data):
-        def play_audio():
-            sd.play(np.frombuffer(audio_data, dtype=np.int16), RATE)
-            sd.wait()
-        
-        await asyncio.get_event_loop().run_in_executor(self.executor, play_audio)
+            self.playback.end()
+            if event.get("response_id") == self.response_id:
+                if self.recording_key and self.recording:
+                    self.audio_cache.put(self.recording_key, bytes(self.recording))
+                self.stop_recording()
+        elif event_type == "response.done":
+            response_id = event.get("response", {}).get("id")
+            if response_id in self.cancelled:
+                self.cancelled.discard(response_id)
+            elif response_id == self.response_id:
+                self.response_id = None
+                self.active_priority = None
+                self.stop_recording()  # Ended without audio.done (e.g. failed); nothing to cache
+            else:
+                return  # Instruction updates don't gate the prompt queue
+            # Next prompt goes out only once nothing, cancelled or not, is still running
+            if self.active_priority is None and not self.cancelled and not self.cancel_pending:
+                self.idle.set()
+
+    async def enqueue_audio(self, samples):
+        # Stream straight into the playback ring; wait for room rather than growing a buffer
+        while len(samples):
+            written = self.playback.write(samples)
+            samples = samples[written:]
+            if len(samples):
+                await asyncio.sleep(0.02)
+
+    def stop_recording(self):
+        self.recording_key = None
+        self.recording.clear()
+
+    async def cancel_response(self):
+        # Stop generating and playing the current response; idle is set by its response.done
+        if self.response_id is not None:
+            self.cancelled.add(self.response_id)
+            await self.send_event({"type": "response.cancel", "response_id": self.response_id})
+            self.response_id = None
+        else:
+            self.cancel_pending = True
+        self.playback.clear()
+        self.stop_recording()
+        self.active_priority = None
+
+    async def submit(self, item, priority):
+        if not self.prompt_queue.put(item, priority):
+            logger.info("Prompt queue full, dropped low-priority prompt")
+            return
+        if self.active_priority is not None and priority < self.active_priority:
+            logger.info("Cancelling in-flight response for a more urgent prompt")
+            await self.cancel_response()
 
     async def send_text(self, text):
         event = {
@@ -83,6 +347,7 @@ class TextToSpeechAgent:
             }
         }
         await self.send_event(event)
+        self.pending_creates.append("prompt")
         await self.send_event({"type": "response.create"})
 
     async def update_instructions(self):
@@ -93,10 +358,12 @@ class TextToSpeechAgent:
                 "instructions": f"You are a supportive AI personal trainer and fitness coach. Your primary job is to encourage your client and get them into fitness. But also critique the form strictly when needed. If you are prompted with something you should say, you should say something along those lines but also feel free to expand upon it and add your own twist. Keep responses brief. You are currently coaching for {self.current_exercise}. Do not respond to this instruction update.",
             }
         }
+        self.pending_creates.append("instructions")
         await self.send_event(event)
         logger.info(f"Updated instructions for workout: {self.current_exercise}")
 
     async def run(self):
+        self.start_playback()
         await self.connect()
         receive_task = asyncio.create_task(self.receive_events())
         
@@ -105,7 +372,17 @@ class TextToSpeechAgent:
         
         try:
             while True:
-                prompt_data = await self.prompt_queue.get()
+                # One response at a time, so queued prompts can still be reordered or merged
+                try:
+                    await asyncio.wait_for(self.idle.wait(), timeout=RESPONSE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("Timed out waiting for response to finish")
+                    # Forget responses the server never finished so the queue can move on
+                    self.response_id = self.active_priority = None
+                    self.cancelled.clear()
+                    self.pending_creates.clear()
+                    self.cancel_pending = False
+                priority, prompt_data = await self.prompt_queue.get()
                 new_exercise = prompt_data.get('exercise')
                 prompt_text = prompt_data.get('text')
 
@@ -116,13 +393,26 @@ class TextToSpeechAgent:
                 if prompt_text:
                     if prompt_text.lower() == 'q':
                         break
+                    if priority == PRIORITY_FEEDBACK:
+                        # Repeated coaching cues play from the local cache without a round-trip
+                        key = self.audio_cache.key(prompt_text, self.current_exercise)
+                        cached = self.audio_cache.get(key)
+                        if cached is not None:
+                            logger.info("Playing cached audio for prompt")
+                            await self.enqueue_audio(np.frombuffer(cached, dtype=np.int16))
+                            self.playback.end()
+                            continue
+                        self.recording_key = key
+                    self.active_priority = priority
+                    self.idle.clear()
                     await self.send_text(prompt_text)
         except Exception as e:
             logger.error(f"An error occurred: {e}")
         finally:
             receive_task.cancel()
             await self.ws.close()
-            self.executor.shutdown()
+            self.output_stream.stop()
+            self.output_stream.close()
 
 async def handle_prompt(request):
     try:
@@ -138,8 +428,12 @@ async def handle_prompt(request):
             queue_item['text'] = prompt
         if exercise:
             queue_item['exercise'] = exercise
+
+        # Periodic form feedback arrives tagged with its exercise; everything else is a user question
+        kind = data.get('priority') or ('feedback' if exercise else 'user')
+        priority = PRIORITY_FEEDBACK if kind == 'feedback' else PRIORITY_USER
         
-        await agent.prompt_queue.put(queue_item)
+        await agent.submit(queue_item, priority)
         return web.json_response({"status": "success", "message": "Request received"})
     except json.JSONDecodeError:
         return web.Response(status=400, text="Invalid JSON")
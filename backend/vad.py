@@ -0,0 +1,109 @@
+from collections import deque
+import numpy as np
+
+
+class VoiceActivityGate:
+    """Hysteresis voice-activity gate over batches of int16 PCM chunks.
+
+    Loudness is the RMS of each chunk, computed for a whole batch in one NumPy
+    pass. Speech starts after `start_chunks` consecutive chunks above the start
+    threshold and ends once the level has stayed under the lower stop threshold
+    for `hangover` seconds. Both thresholds scale with the background noise floor.
+    While the gate is open the floor only learns from chunks below the stop level
+    and is capped so the stop level never exceeds the level that opened the gate,
+    so quieter speech keeps it open; a segment is closed after `max_segment`
+    seconds so sustained noise cannot hold it open. With `spectral=True` a chunk must
+    also have most of its energy in the voice band. The last `preroll` seconds of
+    silence are replayed when speech starts so onsets are not clipped.
+    """
+
+    def __init__(self, rate=16000, chunk=1024, start_threshold=500, stop_threshold=300,
+                 start_chunks=2, hangover=0.4, preroll=0.25, noise_ratio=2.0, max_segment=6.0,
+                 spectral=False, band=(300, 3400), min_band_ratio=0.5):
+        chunk_seconds = chunk / rate
+        self.start_threshold = start_threshold
+        self.stop_threshold = stop_threshold
+        self.start_chunks = start_chunks
+        self.hangover_chunks = max(1, int(round(hangover / chunk_seconds)))
+        self.max_segment_chunks = max(1, int(round(max_segment / chunk_seconds)))
+        self.noise_ratio = noise_ratio
+        self.noise_floor = 0.0
+        self.spectral = spectral
+        self.min_band_ratio = min_band_ratio
+        freqs = np.fft.rfftfreq(chunk, 1.0 / rate)
+        self.band_mask = (freqs >= band[0]) & (freqs <= band[1])
+        self.preroll = deque(maxlen=max(0, int(round(preroll / chunk_seconds))))
+
+        self.active = False
+        self.loud_run = 0
+        self.quiet_run = 0
+        self.segment_chunks = 0
+        self.onset_level = 0.0  # RMS of the chunk that opened the gate
+        self.last_voice = None  # Timestamp of the last voiced chunk while the gate was open
+        self.passed = 0
+        self.gated = 0
+
+    def levels(self, samples):
+        # samples: (n_chunks, chunk) float array; returns RMS per chunk
+        return np.sqrt(np.mean(np.square(samples), axis=1))
+
+    def thresholds(self):
+        # Start and stop levels both follow the noise floor, keeping their ratio
+        scaled = self.noise_floor * self.noise_ratio
+        return (max(self.start_threshold, scaled),
+                max(self.stop_threshold, scaled * self.stop_threshold / self.start_threshold))
+
+    def voiced(self, samples, rms, threshold):
+        loud = rms >= threshold
+        if self.spectral and samples.shape[1] == len(self.band_mask) * 2 - 2:
+            power = np.square(np.abs(np.fft.rfft(samples, axis=1)))
+            total = power.sum(axis=1) + 1e-9
+            loud &= power[:, self.band_mask].sum(axis=1) / total >= self.min_band_ratio
+        return loud
+
+    def process(self, chunks, timestamps):
+        """Returns (chunks to forward to the recognizer, True if a speech segment just ended)."""
+        samples = np.frombuffer(b''.join(chunks), dtype=np.int16).astype(np.float32)
+        samples = samples.reshape(len(chunks), -1)
+        rms = self.levels(samples)
+        start, stop = self.thresholds()
+        loud = self.voiced(samples, rms, start)
+        audible = rms >= stop
+
+        forward = []
+        ended = False
+        for i, data in enumerate(chunks):
+            if not self.active:
+                if rms[i] < start:
+                    self.noise_floor += 0.05 * (rms[i] - self.noise_floor)
+                self.loud_run = self.loud_run + 1 if loud[i] else 0
+                if self.loud_run >= self.start_chunks:
+                    self.active = True
+                    self.quiet_run = 0
+                    self.segment_chunks = 0
+                    self.onset_level = rms[i]
+                    self.last_voice = timestamps[i]
+                    forward.extend(self.preroll)
+                    self.preroll.clear()
+                    forward.append(data)
+                else:
+                    self.preroll.append(data)
+                continue
+
+            if rms[i] < stop:
+                # Only clear silence updates the floor mid-utterance, capped below the onset level
+                cap = self.onset_level * self.start_threshold / (self.noise_ratio * self.stop_threshold)
+                self.noise_floor = min(self.noise_floor + 0.05 * (rms[i] - self.noise_floor), cap)
+            forward.append(data)
+            self.segment_chunks += 1
+            if audible[i]:
+                self.last_voice = timestamps[i]
+            self.quiet_run = 0 if audible[i] else self.quiet_run + 1
+            if self.quiet_run >= self.hangover_chunks or self.segment_chunks >= self.max_segment_chunks:
+                self.active = False
+                self.loud_run = 0
+                ended = True
+
+        self.passed += len(forward)
+        self.gated += len(chunks) - len(forward)
+        return forward, ended